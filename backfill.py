@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""backfill.py
+
+Resumable backfills: rewrite every entity of a kind through a transform
+function, a page at a time, from chained tasks.
+
+A migration is registered with the migration() decorator. Its transform
+takes a list of entities and returns the ones it changed. Those are saved
+with one put_multi and dropped from the entity cache, unless the
+migration saves them itself (put=False); the saved callback then runs
+with them, e.g. to bump cache versions. Transforms must be idempotent,
+because a retried batch is transformed again.
+
+Each run of a migration is a BackfillRun entity holding its checkpoint
+cursor and progress counters. After every batch the checkpoint moves
+forward and the task for the next batch is enqueued, in one transaction
+and with a countdown of `delay` seconds as a throttle. A run that failed
+or was paused restarts from its last checkpoint with resume().
+
+"""
+
+import logging
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import cache
+from models import BackfillRun
+
+DEFAULT_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 500
+RUNNING = 'RUNNING'
+PAUSED = 'PAUSED'
+DONE = 'DONE'
+
+# migration name -> (model class, transform, default batch size, put,
+# saved callback)
+MIGRATIONS = {}
+
+
+def migration(name, model, batchSize=DEFAULT_BATCH_SIZE, put=True,
+              saved=None):
+    """Decorator registering transform as the migration name over every
+    model entity. With put=False the transform saves the entities it
+    changed itself and returns them only to be counted. saved, if given,
+    is called with the changed entities once they are saved."""
+    def decorator(transform):
+        MIGRATIONS[name] = (model, transform, batchSize, put, saved)
+        return transform
+    return decorator
+
+
+def _enqueue(runKey, delay):
+    taskqueue.add(params={'name': runKey.id()},
+                  url='/tasks/backfill',
+                  countdown=delay,
+                  transactional=True
+                  )
+
+
+@ndb.transactional()
+def _startRun(run):
+    run.put()
+    _enqueue(run.key, 0)
+    return run
+
+
+def start(name, batchSize=None, delay=0):
+    """Start migration name from the first entity, replacing any earlier
+    run of it; returns the BackfillRun."""
+    if name not in MIGRATIONS:
+        raise ValueError('Unknown migration: %s' % name)
+    model, transform, defaultBatchSize, put, saved = MIGRATIONS[name]
+    batchSize = min(batchSize or defaultBatchSize, MAX_BATCH_SIZE)
+    return _startRun(BackfillRun(
+        id=name, kind=model._get_kind(), status=RUNNING,
+        batchSize=batchSize, delay=max(delay or 0, 0),
+        started=datetime.now()))
+
+
+@ndb.transactional()
+def resume(name, batchSize=None, delay=None):
+    """Continue a paused or failed run from its checkpoint, optionally
+    with a new batch size or delay; returns the BackfillRun or None."""
+    run = ndb.Key(BackfillRun, name).get()
+    if not run or run.status == DONE:
+        return run
+    if batchSize:
+        run.batchSize = min(batchSize, MAX_BATCH_SIZE)
+    if delay is not None:
+        run.delay = max(delay, 0)
+    run.status = RUNNING
+    run.lastError = None
+    run.put()
+    # if the old chain is still alive, whichever task checkpoints second
+    # sees the cursor has moved and stops
+    _enqueue(run.key, 0)
+    return run
+
+
+@ndb.transactional()
+def pause(name):
+    """Stop a run after its current batch; returns the BackfillRun."""
+    run = ndb.Key(BackfillRun, name).get()
+    if run and run.status == RUNNING:
+        run.status = PAUSED
+        run.put()
+    return run
+
+
+@ndb.transactional()
+def _recordError(runKey, error):
+    run = runKey.get()
+    run.lastError = error[:1000]
+    run.put()
+
+
+@ndb.transactional()
+def _checkpoint(runKey, startCursor, processed, updated, nextCursor):
+    run = runKey.get()
+    if run.cursor != startCursor:
+        # another task already moved past this batch
+        return
+    run.cursor = nextCursor
+    run.processed += processed
+    run.updated += updated
+    run.batches += 1
+    run.lastError = None
+    if not nextCursor:
+        run.status = DONE
+        run.finished = datetime.now()
+    elif run.status == RUNNING:
+        _enqueue(runKey, run.delay)
+    run.put()
+
+
+def runBatch(name):
+    """Transform and save the next batch of a run; run by
+    /tasks/backfill."""
+    runKey = ndb.Key(BackfillRun, name)
+    run = runKey.get()
+    if not run or run.status != RUNNING or name not in MIGRATIONS:
+        return
+    model, transform, defaultBatchSize, put, saved = MIGRATIONS[name]
+    try:
+        cursor = Cursor(urlsafe=run.cursor) if run.cursor else None
+        entities, next_cursor, more = model.query().fetch_page(
+            run.batchSize, start_cursor=cursor)
+        changed = transform(entities) or []
+        if changed and put:
+            ndb.put_multi(changed)
+            cache.invalidate(*[entity.key for entity in changed])
+        if changed and saved:
+            saved(changed)
+    except Exception as e:
+        logging.exception('Backfill %s failed at batch %d',
+                          name, run.batches + 1)
+        _recordError(runKey, '%s: %s' % (type(e).__name__, e))
+        # the task is retried from the same checkpoint
+        raise
+    _checkpoint(runKey, run.cursor, len(entities), len(changed),
+                next_cursor.urlsafe() if more and next_cursor else None)
+
+
+def report():
+    """Return the progress of every registered migration's latest run."""
+    runs = dict((run.key.id(), run) for run in ndb.get_multi(
+        [ndb.Key(BackfillRun, name) for name in sorted(MIGRATIONS)]) if run)
+    result = []
+    for name in sorted(MIGRATIONS):
+        run = runs.get(name)
+        if not run:
+            result.append({'name': name, 'status': None})
+            continue
+        end = run.finished or datetime.now()
+        elapsed = (end - run.started).total_seconds() if run.started else 0
+        result.append({
+            'name': name,
+            'kind': run.kind,
+            'status': run.status,
+            'processed': run.processed,
+            'updated': run.updated,
+            'batches': run.batches,
+            'batchSize': run.batchSize,
+            'delay': run.delay,
+            'entitiesPerSecond': (round(run.processed / elapsed, 1)
+                                  if elapsed else None),
+            'started': run.started.isoformat() if run.started else None,
+            'finished': run.finished.isoformat() if run.finished else None,
+            'lastError': run.lastError,
+        })
+    return result
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""benchmarks/api_calls.py
+
+Endpoint benchmark suite for the Conference API on the App Engine
+testbed's local datastore, memcache and task queue stubs.
+
+For each volume the datastore is seeded with that many conferences,
+sessions and profiles, then each benchmarked ConferenceApi method is
+called directly. Every call is reported with its wall time, datastore
+and memcache RPC counts and memcache hit ratio. Results are written as
+JSON. With --baseline, the run fails if any endpoint makes more datastore
+RPCs per call than the baseline allows.
+
+Run from the project root with the App Engine SDK on the PYTHONPATH:
+
+    python benchmarks/api_calls.py --volumes 10,1000 --output results.json
+    python benchmarks/api_calls.py --baseline results.json
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+import cache
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from conference import CONF_CONDITIONAL_GET_REQUEST
+from models import Conference
+from models import ConferenceQueryForms
+from models import Profile
+from models import Session
+from models import Speaker
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+SEED_BATCH = 500
+ORGANIZERS = 10
+SPEAKERS = 20
+SESSIONS_PER_CONFERENCE = 5
+WISHLIST_SIZE = 10
+
+
+class RpcCounter(object):
+    """Counts API calls per service through an apiproxy pre-call hook."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def count(self, service, call, request, response):
+        self.counts[service] += 1
+
+    def install(self):
+        # every testbed activation creates a new apiproxy
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'benchmark_rpc_counter', self.count)
+
+    def reset(self):
+        self.counts.clear()
+
+
+def login(email):
+    """Make endpoints.get_current_user() return a user for email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+
+def seed(volume):
+    """Store `volume` conferences, sessions and profiles; return the
+    keys the benchmarks need."""
+    speakers = [Speaker(key=ndb.Key(Speaker, n + 1),
+                        speaker_name='Speaker %d' % n)
+                for n in range(SPEAKERS)]
+    ndb.put_multi(speakers)
+
+    organizers = ['organizer%d@example.com' % n for n in range(ORGANIZERS)]
+    entities = [Profile(key=ndb.Key(Profile, email), displayName=email,
+                        mainEmail=email) for email in organizers]
+    confKeys = []
+    for n in range(volume):
+        p_key = ndb.Key(Profile, organizers[n % ORGANIZERS])
+        c_key = ndb.Key(Conference, n + 1, parent=p_key)
+        confKeys.append(c_key)
+        entities.append(Conference(
+            key=c_key, name='Conference %d' % n, description='x' * 200,
+            organizerUserId=p_key.id(), topics=['Web'], city='London',
+            startDate=datetime.date(2016, 1 + n % 12, 1), month=1 + n % 12,
+            maxAttendees=volume, seatsAvailable=volume))
+        for s in range(SESSIONS_PER_CONFERENCE):
+            entities.append(Session(
+                key=ndb.Key(Session, s + 1, parent=c_key),
+                session_name='Session %d' % s, typeOfSession='lecture',
+                speakerKey=speakers[(n + s) % SPEAKERS].key.urlsafe(),
+                duration=60, startDate=datetime.date(2016, 1, 1),
+                startTime=datetime.time(9 + s, 0)))
+    sessionKeys = [key for key in (e.key for e in entities)
+                   if key.kind() == 'Session']
+    attendees = ['attendee%d@example.com' % n for n in range(volume)]
+    for email in attendees:
+        entities.append(Profile(
+            key=ndb.Key(Profile, email), displayName=email, mainEmail=email,
+            sessionWishlist=[key.urlsafe()
+                             for key in sessionKeys[:WISHLIST_SIZE]]))
+    for i in range(0, len(entities), SEED_BATCH):
+        ndb.put_multi(entities[i:i + SEED_BATCH])
+    return confKeys, attendees
+
+
+def benchmarks(confKeys, attendees):
+    """Return (name, callable) pairs; each callable makes one call on a
+    new ConferenceApi, as every request gets its own service instance
+    and the caller and Profile are remembered on it."""
+    wsck = confKeys[0].urlsafe()
+    registrations = iter(attendees)
+
+    def register():
+        login(next(registrations))
+        ConferenceApi().registerForConference(
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck))
+
+    def wishlist():
+        login(attendees[0])
+        ConferenceApi().getSessionsInWishlist(message_types.VoidMessage())
+
+    return [
+        ('queryConferences',
+         lambda: ConferenceApi().queryConferences(ConferenceQueryForms())),
+        ('getConference',
+         lambda: ConferenceApi().getConference(
+             CONF_CONDITIONAL_GET_REQUEST.combined_message_class(
+                 websafeConferenceKey=wsck))),
+        ('getConferenceSessions',
+         lambda: ConferenceApi().getConferenceSessions(
+             CONF_CONDITIONAL_GET_REQUEST.combined_message_class(
+                 websafeConferenceKey=wsck))),
+        ('getSessionsInWishlist', wishlist),
+        ('registerForConference', register),
+    ]
+
+
+def run(volume, iterations, counter):
+    """Seed a fresh testbed with volume entities and time every
+    benchmark; return one result dict per endpoint."""
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    counter.install()
+    try:
+        confKeys, attendees = seed(volume)
+        results = []
+        for name, call in benchmarks(confKeys, attendees):
+            calls = float(min(iterations, len(attendees)))
+            wall = 0.0
+            before = memcache.get_stats()
+            counter.reset()
+            for _ in range(int(calls)):
+                # every call behaves like a new request on a warm instance
+                ndb.get_context().clear_cache()
+                start = time.time()
+                call()
+                wall += time.time() - start
+            counts = dict(counter.counts)
+            after = memcache.get_stats()
+            hits = after['hits'] - before['hits']
+            misses = after['misses'] - before['misses']
+            results.append({
+                'endpoint': name,
+                'volume': volume,
+                'calls': int(calls),
+                'wall_ms': round(wall * 1000.0 / calls, 3),
+                'datastore_rpcs': counts.get('datastore_v3', 0) / calls,
+                'memcache_rpcs': counts.get('memcache', 0) / calls,
+                'taskqueue_rpcs': counts.get('taskqueue', 0) / calls,
+                'memcache_hit_ratio': (round(hits / float(hits + misses), 3)
+                                       if hits + misses else None),
+            })
+        return results
+    finally:
+        cache._local.clear()
+        tb.deactivate()
+
+
+def regressions(results, baseline, tolerance):
+    """Return messages for endpoints whose datastore RPCs per call went
+    above the baseline run."""
+    allowed = dict(((r['endpoint'], r['volume']), r['datastore_rpcs'])
+                   for r in baseline)
+    failures = []
+    for r in results:
+        limit = allowed.get((r['endpoint'], r['volume']))
+        if limit is not None and r['datastore_rpcs'] > limit + tolerance:
+            failures.append(
+                '%s @ %d: %.2f datastore RPCs/call (baseline %.2f)' % (
+                    r['endpoint'], r['volume'], r['datastore_rpcs'], limit))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--volumes', default='10,1000,10000',
+                        help='comma separated entity volumes to seed')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='calls per endpoint and volume')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--baseline',
+                        help='JSON results to compare datastore RPCs with')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='extra datastore RPCs/call allowed')
+    args = parser.parse_args()
+
+    os.environ.setdefault('APPLICATION_ID', 'dev~benchmark')
+    counter = RpcCounter()
+    results = []
+    for volume in [int(v) for v in args.volumes.split(',')]:
+        results.extend(run(volume, args.iterations, counter))
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print report
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            sys.stderr.write('RPC regression: %s\n' % failure)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""benchmarks/serializer_copy.py
+
+Micro-benchmark for the per-item cost of copying entities onto messages:
+the original all_fields()/hasattr() loop against the precompiled plans in
+serializers.py. No datastore is used; entities are built in memory.
+
+Run from the project root with the App Engine SDK on the PYTHONPATH:
+
+    python benchmarks/serializer_copy.py [items] [repeats]
+
+"""
+
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('APPLICATION_ID', 'dev~benchmark')
+
+from google.appengine.ext import ndb
+
+import serializers
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+
+
+def legacyCopy(entity, messageClass):
+    """The copy loop used by the _copy*ToForm functions before
+    serializers.py."""
+    form = messageClass()
+    for field in form.all_fields():
+        if hasattr(entity, field.name):
+            if (field.name.endswith('Date') or
+                    field.name.endswith('Time')):
+                setattr(form, field.name, str(getattr(entity, field.name)))
+            else:
+                setattr(form, field.name, getattr(entity, field.name))
+        elif field.name in serializers.KEY_FIELDS:
+            setattr(form, field.name, entity.key.urlsafe())
+    form.check_initialized()
+    return form
+
+
+def makeEntities(count):
+    p_key = ndb.Key('Profile', 'organizer@example.com')
+    conferences = []
+    sessions = []
+    for n in range(1, count + 1):
+        c_key = ndb.Key(Conference, n, parent=p_key)
+        conferences.append(Conference(
+            key=c_key, name='Conference %d' % n, description='x' * 200,
+            organizerUserId=p_key.id(), topics=['Web', 'Cloud'],
+            city='London', startDate=datetime.date(2016, 5, 1), month=5,
+            endDate=datetime.date(2016, 5, 3), maxAttendees=100,
+            seatsAvailable=100))
+        sessions.append(Session(
+            key=ndb.Key(Session, n, parent=c_key),
+            session_name='Session %d' % n, highlights='y' * 100,
+            speakerKey='speaker', duration=60, typeOfSession='lecture',
+            startDate=datetime.date(2016, 5, 1),
+            startTime=datetime.time(9, 30)))
+    return conferences, sessions
+
+
+def main(items=1000, repeats=5):
+    conferences, sessions = makeEntities(items)
+    cases = [
+        ('Conference', conferences, ConferenceForm),
+        ('Session', sessions, SessionForm),
+    ]
+    print '%-12s %14s %14s %8s' % ('kind', 'legacy us/item',
+                                   'plan us/item', 'speedup')
+    for kind, entities, messageClass in cases:
+        legacy = min(timeit.repeat(
+            lambda: [legacyCopy(e, messageClass) for e in entities],
+            number=1, repeat=repeats))
+        planned = min(timeit.repeat(
+            lambda: serializers.toMessages(entities, messageClass),
+            number=1, repeat=repeats))
+        print '%-12s %14.2f %14.2f %7.2fx' % (
+            kind, legacy * 1e6 / items, planned * 1e6 / items,
+            legacy / planned)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
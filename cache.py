@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Read-through entity cache for the hot Conference, Speaker and Profile
+reads of the Conference Central API.
+
+Entities are held serialized in two tiers: a bounded in-process LRU per
+instance and memcache shared by all instances. Every read returns a fresh
+copy, so callers may modify and put() what they get back. Write paths
+must call invalidate() with the keys they changed, after the write; other
+instances may keep serving their local copy for up to LOCAL_TTL seconds,
+so reads answered with a version token skip the local tier.
+
+As in ndb's own cache, invalidate() leaves a short-lived lock value in
+memcache rather than deleting the entry, and reads only fill memcache
+with add(). A read that missed before a write and fetched the old entity
+can therefore never store it over the lock.
+
+It also keeps named version counters in memcache, which write paths bump
+and conditional reads compare against the client's ifNoneMatch token.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+LOCAL_SIZE = 1000
+LOCAL_TTL = 30
+MEMCACHE_TTL = 600
+MEMCACHE_PREFIX = 'ENTITY:'
+# memcache value of an invalidated entry, kept for LOCK_TTL seconds
+LOCKED = 0
+LOCK_TTL = 32
+VERSION_PREFIX = 'VERSION:'
+
+
+class LRUCache(object):
+    """Bounded, thread-safe least-recently-used cache with expiry."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[1] < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._items[key] = item
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time() + self.ttl)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_local = LRUCache(LOCAL_SIZE, LOCAL_TTL)
+_adapter = ndb.ModelAdapter()
+
+
+def _encode(entity):
+    return entity._to_pb().Encode()
+
+
+def _decode(data):
+    return _adapter.pb_to_entity(entity_pb.EntityProto(data))
+
+
+@ndb.tasklet
+def getMultiAsync(keys, local=True):
+    """Tasklet returning the entities for keys, in order, with None for
+    missing entities. Reads the local tier, then memcache, then the
+    datastore; memcache and datastore calls are batched by ndb. With
+    local=False the local tier, which other instances' writes do not
+    clear, is skipped; use it when the reply carries a version token."""
+    found = {}
+    missing = []
+    for key in set(keys):
+        data = _local.get(key.urlsafe()) if local else None
+        if data:
+            found[key] = data
+        else:
+            missing.append(key)
+
+    ctx = ndb.get_context()
+    locked = set()
+    if missing:
+        cached = yield [ctx.memcache_get(MEMCACHE_PREFIX + key.urlsafe())
+                        for key in missing]
+        for key, data in zip(missing, cached):
+            if data == LOCKED:
+                # written moments ago; read it but leave memcache alone
+                locked.add(key)
+            elif data:
+                found[key] = data
+                _local.set(key.urlsafe(), data)
+        missing = [key for key in missing if key not in found]
+
+    if missing:
+        entities = yield ndb.get_multi_async(missing)
+        fills = []
+        for key, entity in zip(missing, entities):
+            if entity is None:
+                continue
+            data = found[key] = _encode(entity)
+            if key in locked:
+                # read after the write that took the lock
+                _local.set(key.urlsafe(), data)
+            else:
+                fills.append((key, data, ctx.memcache_add(
+                    MEMCACHE_PREFIX + key.urlsafe(), data,
+                    time=MEMCACHE_TTL)))
+        for key, data, added in fills:
+            # add() fails if a writer locked the key since our miss, in
+            # which case data may be older than the write
+            if (yield added):
+                _local.set(key.urlsafe(), data)
+
+    raise ndb.Return(
+        [_decode(found[key]) if key in found else None for key in keys])
+
+
+@ndb.tasklet
+def getAsync(key, local=True):
+    """Tasklet returning the entity for key, or None."""
+    entities = yield getMultiAsync([key], local)
+    raise ndb.Return(entities[0])
+
+
+def getMulti(keys, local=True):
+    """Return the entities for keys, in order, with None for missing
+    entities."""
+    return getMultiAsync(keys, local).get_result()
+
+
+def get(key, local=True):
+    """Return the entity for key, or None if it does not exist."""
+    return getAsync(key, local).get_result()
+
+
+def invalidate(*keys):
+    """Drop keys from the local tier and lock them in memcache for
+    LOCK_TTL seconds; call after writing them."""
+    for key in keys:
+        _local.delete(key.urlsafe())
+    memcache.set_multi(dict((key.urlsafe(), LOCKED) for key in keys),
+                       time=LOCK_TTL, key_prefix=MEMCACHE_PREFIX)
+
+
+def _versionSeed():
+    # counters recreated after an eviction start from the current time,
+    # so they never repeat a token handed out before
+    return int(time.time() * 1000)
+
+
+def bumpVersions(*names):
+    """Increment the version counters for names after writing the data
+    they cover."""
+    memcache.offset_multi(dict((name, 1) for name in names),
+                          key_prefix=VERSION_PREFIX,
+                          initial_value=_versionSeed())
+
+
+def versionToken(*names):
+    """Return a token for the current versions of names, or None if
+    memcache is unavailable. Equal tokens mean none of the data changed."""
+    versions = memcache.get_multi(list(names), key_prefix=VERSION_PREFIX)
+    missing = [name for name in names if name not in versions]
+    if missing:
+        versions.update(memcache.offset_multi(
+            dict((name, 0) for name in missing),
+            key_prefix=VERSION_PREFIX,
+            initial_value=_versionSeed()))
+    if any(versions.get(name) is None for name in names):
+        return None
+    return '-'.join(str(versions[name]) for name in names)
@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 from datetime import datetime
+import hashlib
 import json
 import os
+import random
 import time
 import logging
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protobuf
 from protorpc import remote
 
 from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 
@@ -19,34 +24,93 @@ from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import FacetCounts
+from models import FacetForm
+from models import FacetForms
+from models import FacetValueForm
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SpeakerSessionCount
+from models import FeaturedSpeaker
+from models import SeatShard
+from models import Announcement
 from models import Profile
+from models import Registration
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import ProfileForms
 from models import TeeShirtSize
 from models import StringMessage
 from models import BooleanMessage
+from models import BatchResultForm
+from models import BatchResultForms
 from models import ConflictException
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
-
+from models import ExportForm
+from models import ExportJob
+from models import SearchResultForm
+from models import SearchResultForms
+
+import cache
+import export
+import metrics
+import serializers
+import queryplanner
+import textsearch
 from settings import WEB_CLIENT_ID
 from utils import getUserId
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+ANNOUNCEMENT_ID = "nearly_sold_out"
+NEARLY_SOLD_OUT_SEATS = 5
+VERSION_CONFERENCE = "conference:%s"
+VERSION_SESSIONS = "sessions:%s"
+VERSION_PROFILE = "profile:%s"
+# generation of every conference listing; bumped by any conference or
+# seat change
+VERSION_CONFERENCES = "conferences"
+MEMCACHE_CONFERENCE_QUERY_KEY = "CONFERENCE_QUERY:%s:%s"
+CONFERENCE_QUERY_TTL = 600
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
+# seats available per conference for list views, summed from its seat
+# shards; registrations adjust it and it is recounted after SEATS_TTL
+MEMCACHE_SEATS_KEY = "SEATS:%s"
+SEATS_TTL = 60
+FEATURED_SPEAKER_ID = "featured"
 
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    summary=messages.BooleanField(1),
+)
+
+CONF_CONDITIONAL_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+PROFILE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+CONF_ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
 CONF_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -77,6 +141,45 @@ SESSION_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     typeOfSession=messages.StringField(2),
 )
 
+PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    limit=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
+SESSION_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    typeOfSession=messages.StringField(2),
+    excludeTypes=messages.StringField(3, repeated=True),
+    startAfter=messages.StringField(4),
+    startBefore=messages.StringField(5),
+    duration=messages.IntegerField(6),
+    startDate=messages.StringField(7),
+    limit=messages.IntegerField(8),
+    pageToken=messages.StringField(9),
+)
+
+EXPORT_POST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    kind=messages.StringField(2),
+    format=messages.StringField(3),
+)
+
+EXPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeExportKey=messages.StringField(1),
+)
+
+TEXT_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    kind=messages.StringField(2),
+    limit=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+)
+
 SESSION_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speakerKey=messages.StringField(1),
@@ -103,6 +206,13 @@ OPERATORS = {
     'NE': '!='
 }
 
+NUM_SEAT_SHARDS = 20
+
+MAX_BATCH_SIZE = 100
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 FIELDS = {
     'CITY': 'city',
     'TOPIC': 'topics',
@@ -110,6 +220,20 @@ FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees',
 }
 
+# Conference properties read for summary list responses, by projection
+# where the query allows; summary ConferenceForms carry only these and
+# the websafeKey
+SUMMARY_PROPERTIES = ('name', 'city', 'startDate', 'endDate',
+                      'maxAttendees', 'seatsAvailable')
+SUMMARY_FIELDS = SUMMARY_PROPERTIES + ('websafeKey',)
+
+# filter fields with precomputed conference counts
+FACETS = ('CITY', 'TOPIC', 'MONTH')
+FACET_COUNTS_ID = "conference"
+NUM_FACET_SHARDS = 20
+# task names remembered per facet shard, to skip retried tasks
+FACET_APPLIED_TASKS = 50
+
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -120,35 +244,33 @@ FIELDS = {
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    # endpoints creates a service instance per request, so these hold
+    # the caller's identity and Profile for the current request
+    _user = None
+    _userId = None
+    _profile = None
+
     # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, seatsAvailable=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = serializers.toMessage(conf, ConferenceForm)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
+        if seatsAvailable is not None:
+            cf.seatsAvailable = seatsAvailable
         return cf
 
-    @staticmethod
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning
-        ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    def _copyConferenceSummaryToForm(self, conf, seatsAvailable):
+        """Copy SUMMARY_FIELDS from Conference to ConferenceForm."""
+        cf = serializers.toMessage(conf, ConferenceForm, SUMMARY_FIELDS)
+        cf.seatsAvailable = seatsAvailable
+        return cf
 
+    @staticmethod
+    def _conferenceDataFromForm(request):
+        """Validate a ConferenceForm and return the Conference property
+        dict for it, filling in defaults on both."""
         if not request.name:
             raise endpoints.BadRequestException(
                 "Conference 'name' field required")
@@ -158,6 +280,8 @@ class ConferenceApi(remote.Service):
                 request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing
         for df in DEFAULTS:
@@ -167,21 +291,35 @@ class ConferenceApi(remote.Service):
 
         # convert dates from strings to Date objects;
         # set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10],
-                                                  "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10],
-                                                "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(
+                    data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(
+                    data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Conference dates must be in YYYY-MM-DD format")
 
         # set seatsAvailable to be same as maxAttendees on creation
         # both for data model & outbound Message
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
+        return data
+
+    @staticmethod
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning
+        ConferenceForm/request."""
+        # preload necessary data items
+        user = self._getUser()
+        user_id = self._getUserId()
+        data = self._conferenceDataFromForm(request)
 
         # make Profile Key from user ID
         p_key = ndb.Key(Profile, user_id)
@@ -191,9 +329,16 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        data['organizerDisplayName'] = request.organizerDisplayName = (
+            self._getProfileFromUser().displayName)
 
         # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        conf = Conference(**data)
+        self._putConferences([conf])
+        cache.invalidate(c_key)
+        textsearch.index([conf])
+        cache.bumpVersions(VERSION_CONFERENCE % c_key.urlsafe(),
+                           VERSION_CONFERENCES)
         # send confirmation email
         taskqueue.add(params={'email': user.email(),
                               'conferenceInfo': repr(request)},
@@ -201,32 +346,306 @@ class ConferenceApi(remote.Service):
                       )
         return request
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    @endpoints.method(ConferenceForms, BatchResultForms,
+                      path='conferences/batch',
+                      http_method='POST', name='createConferences')
+    @metrics.instrument()
+    def createConferences(self, request):
+        """Create up to MAX_BATCH_SIZE conferences in one call, reporting
+        the outcome of each item."""
+        user = self._getUser()
+        user_id = self._getUserId()
+        if len(request.items) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                "At most %d conferences per batch" % MAX_BATCH_SIZE)
+
+        # validate every form first; invalid items are reported back
+        results = {}
+        valid = []
+        for index, form in enumerate(request.items):
+            try:
+                valid.append((index, form, self._conferenceDataFromForm(form)))
+            except endpoints.BadRequestException as e:
+                results[index] = BatchResultForm(index=index, error=str(e))
+
+        if valid:
+            displayName = self._getProfileFromUser().displayName
+            # allocate every Conference ID with one call
+            p_key = ndb.Key(Profile, user_id)
+            first, last = Conference.allocate_ids(
+                size=len(valid), parent=p_key)
+            conferences = []
+            tasks = []
+            for (index, form, data), c_id in zip(valid,
+                                                 range(first, last + 1)):
+                data['key'] = ndb.Key(Conference, c_id, parent=p_key)
+                data['organizerUserId'] = form.organizerUserId = user_id
+                data['organizerDisplayName'] = displayName
+                conferences.append(Conference(**data))
+                tasks.append(taskqueue.Task(
+                    params={'email': user.email(),
+                            'conferenceInfo': repr(form)},
+                    url='/tasks/send_confirmation_email'))
+                results[index] = BatchResultForm(
+                    index=index, websafeKey=data['key'].urlsafe())
+
+            self._putConferences(conferences)
+            cache.invalidate(*[conf.key for conf in conferences])
+            textsearch.index(conferences)
+            cache.bumpVersions(VERSION_CONFERENCES,
+                               *[VERSION_CONFERENCE % conf.key.urlsafe()
+                                 for conf in conferences])
+            # send confirmation emails
+            taskqueue.Queue().add(tasks)
+
+        return BatchResultForms(
+            items=[results[index] for index in sorted(results)])
+
+    @staticmethod
+    def _conferenceFacets(conf):
+        """Return the (facet, value) pairs conf is counted under."""
+        facets = set()
+        for facet in FACETS:
+            values = getattr(conf, FIELDS[facet])
+            if not isinstance(values, list):
+                values = [values]
+            facets.update((facet, unicode(value)) for value in values
+                          if value not in (None, ''))
+        return facets
+
+    @staticmethod
+    def _facetShardKeys():
+        """Return the FacetCounts shard keys, in index order."""
+        return [ndb.Key(FacetCounts, '%s-%d' % (FACET_COUNTS_ID, index))
+                for index in range(NUM_FACET_SHARDS)]
+
+    @staticmethod
+    @ndb.transactional()
+    def _putConferences(conferences):
+        """Save conferences and enqueue, with the commit, the task that
+        moves the facet counts from their stored versions (if any) to the
+        new ones. The conferences must share an organiser, so this
+        touches one entity group; the counts are not in it."""
+        stored = ndb.get_multi([conf.key for conf in conferences])
+        deltas = {}
+        tasks = []
+        for old, new in zip(stored, conferences):
+            if old and old.name != new.name:
+                tasks.append(taskqueue.Task(
+                    params={'websafeConferenceKey': new.key.urlsafe()},
+                    url='/tasks/update_session_names'))
+            before = ConferenceApi._conferenceFacets(old) if old else set()
+            after = ConferenceApi._conferenceFacets(new)
+            for facet, value in before - after:
+                values = deltas.setdefault(facet, {})
+                values[value] = values.get(value, 0) - 1
+            for facet, value in after - before:
+                values = deltas.setdefault(facet, {})
+                values[value] = values.get(value, 0) + 1
+        ndb.put_multi(conferences)
+        if deltas:
+            taskqueue.add(params={'deltas': json.dumps(deltas)},
+                          url='/tasks/update_facet_counts',
+                          transactional=True
+                          )
+        if tasks:
+            # copy new names onto the conferences' sessions
+            ndb.get_context().call_on_commit(
+                lambda: taskqueue.Queue().add(tasks))
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateFacetShard(shardKey, deltas, taskName):
+        """Add deltas to the FacetCounts shard, unless the task taskName
+        already did."""
+        shard = shardKey.get() or FacetCounts(key=shardKey)
+        if taskName and taskName in shard.appliedTasks:
+            return
+        counts = shard.counts or {}
+        for facet, changes in deltas.items():
+            values = counts.setdefault(facet, {})
+            for value, change in changes.items():
+                values[value] = values.get(value, 0) + change
+                if not values[value]:
+                    del values[value]
+        shard.counts = counts
+        if taskName:
+            shard.appliedTasks = (shard.appliedTasks +
+                                  [taskName])[-FACET_APPLIED_TASKS:]
+        shard.put()
+
+    @staticmethod
+    def _applyFacetDeltas(deltas, taskName=None):
+        """Add deltas ({facet: {value: change}}) to one FacetCounts
+        shard; run by /tasks/update_facet_counts. A retried task picks
+        the same shard from its name and is applied only once."""
+        if taskName:
+            index = int(hashlib.sha1(taskName).hexdigest(), 16)
+        else:
+            index = random.randrange(NUM_FACET_SHARDS)
+        shardKey = ConferenceApi._facetShardKeys()[index % NUM_FACET_SHARDS]
+        ConferenceApi._updateFacetShard(shardKey, deltas, taskName)
+        cache.invalidate(shardKey)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
+    @staticmethod
+    @ndb.transactional()
+    def _resetFacetShard(shardKey, counts):
+        """Replace the counts of the FacetCounts shard, keeping the tasks
+        it has applied: a retry of one of them must still be skipped, as
+        the recount already includes its change."""
+        shard = shardKey.get() or FacetCounts(key=shardKey)
+        shard.counts = counts
+        shard.put()
+
+    @staticmethod
+    def _rebuildFacetCounts():
+        """Recount every facet from the conferences, counting each one
+        under the same values as _putConferences does; used by the cron
+        job to repair the counts kept up to date by _applyFacetDeltas.
+        The totals go to the first shard and the others are emptied."""
+        counts = {}
+        for conf in Conference.query().iter(batch_size=1000):
+            for facet, value in ConferenceApi._conferenceFacets(conf):
+                values = counts.setdefault(facet, {})
+                values[value] = values.get(value, 0) + 1
+        keys = ConferenceApi._facetShardKeys()
+        for index, key in enumerate(keys):
+            ConferenceApi._resetFacetShard(key, counts if index == 0 else {})
+        cache.invalidate(*keys)
+        return counts
+
+    @endpoints.method(message_types.VoidMessage, FacetForms,
+                      path='conferences/facets',
+                      http_method='GET',
+                      name='getConferenceFacets')
+    @metrics.instrument()
+    def getConferenceFacets(self, request):
+        """Return the number of conferences for every city, topic and
+        month, most common first."""
+        # the counts are the sum of the shards
+        counts = {}
+        for shard in cache.getMulti(self._facetShardKeys()):
+            for facet, values in ((shard and shard.counts) or {}).items():
+                totals = counts.setdefault(facet, {})
+                for value, count in values.items():
+                    totals[value] = totals.get(value, 0) + count
+        for values in counts.values():
+            for value in [v for v in values if values[v] <= 0]:
+                del values[value]
+        items = []
+        for facet in FACETS:
+            values = counts.get(facet, {})
+            items.append(FacetForm(field=facet, values=[
+                FacetValueForm(value=value, count=values[value])
+                for value in sorted(values,
+                                    key=lambda v: (-values[v], v))]))
+        return FacetForms(items=items)
+
+    def _getQuery(self, request):
+        """Return the planned query and in-memory predicates for the
+        submitted filters."""
+        return queryplanner.plan(self._formatFilters(request.filters))
+
+    def _conferenceQueryCacheKey(self, request):
+        """Return the memcache key for the results of a queryConferences
+        request at the current conference generation, or None if the
+        generation is unavailable. Equivalent filter sets share a key."""
+        generation = cache.versionToken(VERSION_CONFERENCES)
+        if not generation:
+            return None
+        filters = []
+        for f in request.filters:
+            value = (f.value or '').strip()
+            if FIELDS.get(f.field) in ('month', 'maxAttendees'):
+                try:
+                    value = str(int(value))
+                except ValueError:
+                    pass
+            filters.append([f.field, f.operator, value])
+        limit = request.limit
+        if not limit or limit <= 0:
+            limit = DEFAULT_PAGE_SIZE
+        normalized = json.dumps([sorted(filters), min(limit, MAX_PAGE_SIZE),
+                                 request.pageToken or None,
+                                 bool(request.summary)])
+        return MEMCACHE_CONFERENCE_QUERY_KEY % (
+            generation, hashlib.sha1(normalized).hexdigest())
+
+    @ndb.tasklet
+    def _fetchPageAsync(self, query, limit, pageToken):
+        """Tasklet fetching a single page of results from query, returning
+        the entities and the websafe cursor for the next page (or None)."""
+        if not limit or limit <= 0:
+            limit = DEFAULT_PAGE_SIZE
+        limit = min(limit, MAX_PAGE_SIZE)
+        try:
+            cursor = Cursor(urlsafe=pageToken) if pageToken else None
+        except Exception:
+            raise endpoints.BadRequestException(
+                "Invalid pageToken: %s" % pageToken)
+        results, next_cursor, more = yield query.fetch_page_async(
+            limit, start_cursor=cursor)
+        nextPageToken = None
+        if more and next_cursor:
+            nextPageToken = next_cursor.urlsafe()
+        raise ndb.Return((results, nextPageToken))
+
+    def _fetchPage(self, query, limit, pageToken):
+        """Fetch a single page of results from query, returning the
+        entities and the websafe cursor for the next page (or None)."""
+        return self._fetchPageAsync(query, limit, pageToken).get_result()
+
+    @ndb.tasklet
+    def _getConferenceFormsAsync(self, confKeys, confs=None,
+                                 summary=False, local=True, exact=False):
+        """Tasklet returning ConferenceForms for confKeys, skipping missing
+        conferences. The conferences (unless already loaded) and their
+        seat counts are fetched concurrently; organiser Profiles are only
+        read for conferences stored before organizerDisplayName was.
+        Summary forms only need SUMMARY_PROPERTIES, so confs may be
+        projections. local=False reads past the instance cache tier.
+        Seat counts come from the cached totals of list views unless
+        exact is set, which sums the seat shards."""
+        if exact:
+            seatsFuture = self._getStoredSeatShardsAsync(confKeys)
         else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(
-                filtr["field"],
-                filtr["operator"],
-                filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+            seatsFuture = self._getCachedSeatsAsync(confKeys)
+        if confs is None:
+            confs, seats = yield (
+                cache.getMultiAsync(confKeys, local), seatsFuture)
+        else:
+            seats = yield seatsFuture
+        if exact:
+            seats = [self._countSeats(conf, shards) if conf else None
+                     for conf, shards in zip(confs, seats)]
+        else:
+            seats = yield self._fillCachedSeatsAsync(confs, seats)
+
+        if summary:
+            raise ndb.Return([
+                self._copyConferenceSummaryToForm(conf, count)
+                for conf, count in zip(confs, seats) if conf])
+
+        organisers = list(set(
+            conf.key.parent() for conf in confs
+            if conf and conf.organizerDisplayName is None))
+        names = {}
+        if organisers:
+            profiles = yield cache.getMultiAsync(organisers, local)
+            for profile in profiles:
+                if profile:
+                    names[profile.key] = profile.displayName
+
+        raise ndb.Return([
+            self._copyConferenceToForm(
+                conf, names.get(conf.key.parent()), count)
+            for conf, count in zip(confs, seats) if conf])
 
     def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters.
+        Inequalities may be used on any number of fields; the query
+        planner decides which of them the datastore serves."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name)
@@ -239,103 +658,128 @@ class ConferenceApi(remote.Service):
                 raise endpoints.BadRequestException("Filter contains invalid \
                     field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                """check if inequality operation has been used in previous
-                filters disallow the filter if inequality was performed on a
-                different field before track the field on which the
-                inequality operation is performed
-                """
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is \
-                        allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in queryplanner.INTEGER_FIELDS:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number" % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_CONDITIONAL_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
+    @metrics.instrument()
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        """Return requested conference (by websafeConferenceKey), or a
+        notModified reply if it still matches the ifNoneMatch etag."""
+        wsck = request.websafeConferenceKey
+        confKey = ndb.Key(urlsafe=wsck)
+        # organiser name changes are written to the conference, so its
+        # version covers the whole form
+        etag = cache.versionToken(VERSION_CONFERENCE % wsck)
+        if etag and etag == request.ifNoneMatch:
+            return ConferenceForm(etag=etag, notModified=True)
+
+        # get Conference and seats together; bail if not found. the
+        # instance cache tier may be older than the etag
+        forms = self._getConferenceFormsAsync(
+            [confKey], local=False, exact=True).get_result()
+        if not forms:
             raise endpoints.NotFoundException(
-                "No conference found with key: %s" % request.websafeConferenceKey)  # noqa
-        prof = conf.key.parent().get()
+                "No conference found with key: %s" % wsck)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        forms[0].etag = etag
+        return forms[0]
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
+    @metrics.instrument()
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(self, request)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST',
                       name='getConferencesCreated')
+    @metrics.instrument()
     def getConferencesCreated(self, request):
-        """Query for conferences."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        p_key = ndb.Key(Profile, getUserId(user))
+        """Query for conferences; summary returns only SUMMARY_FIELDS."""
+        p_key = ndb.Key(Profile, self._getUserId())
         # create ancestor query for all key matches for this user
-        conferences = Conference.query(ancestor=p_key)
-        prof = p_key.get()
-        displayName = getattr(prof, 'displayName')
+        if request.summary:
+            conferences = Conference.query(ancestor=p_key).order(
+                Conference.name).fetch(projection=SUMMARY_PROPERTIES)
+        else:
+            conferences = Conference.query(ancestor=p_key).fetch()
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, displayName)
-                   for conf in conferences]
+            items=self._getConferenceFormsAsync(
+                [conf.key for conf in conferences], conferences,
+                summary=bool(request.summary)).get_result()
         )
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
+    @metrics.instrument()
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        """Query for conferences, one page at a time. Pages are cached
+        until the next conference or seat change."""
+        cacheKey = self._conferenceQueryCacheKey(request)
+        if cacheKey:
+            cached = memcache.get(cacheKey)
+            # an empty page encodes to ''
+            if cached is not None:
+                return protobuf.decode_message(ConferenceForms, cached)
+
+        # run the planned query, checking the filters it could not
+        # serve as the results stream in
+        q, predicates = self._getQuery(request)
+        limit = request.limit
+        if not limit or limit <= 0:
+            limit = DEFAULT_PAGE_SIZE
+        # only the unfiltered listing has an index for a projection
+        projection = None
+        if request.summary and not request.filters:
+            projection = SUMMARY_PROPERTIES
+        try:
+            conferences, nextPageToken = queryplanner.fetchPageAsync(
+                q, predicates, min(limit, MAX_PAGE_SIZE),
+                request.pageToken, projection=projection).get_result()
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException(
+                "Invalid pageToken: %s" % request.pageToken)
 
+        # seat counts are fetched for the whole page at once
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                    conf,
-                    names[conf.organizerUserId])
-                   for conf in conferences]
+        forms = ConferenceForms(
+            items=self._getConferenceFormsAsync(
+                [conf.key for conf in conferences], conferences,
+                summary=bool(request.summary)).get_result(),
+            nextPageToken=nextPageToken
         )
+        if cacheKey:
+            memcache.set(cacheKey, protobuf.encode_message(forms),
+                         time=CONFERENCE_QUERY_TTL)
+        return forms
 
-    @endpoints.method(CONF_GET_REQUEST, ProfileForms,
+    @endpoints.method(CONF_ATTENDEES_GET_REQUEST, ProfileForms,
                       path='getConferenceAttendees',
                       http_method='POST',
                       name='getConferenceAttendees')
+    @metrics.instrument()
     def getConferenceAttendees(self, request):
         """Allows the creator of the conference to list all attendees"""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self._getUserId()
         wsck = request.websafeConferenceKey
         confKey = ndb.Key(urlsafe=wsck)
-        conf = confKey.get()
+
+        conf = cache.get(confKey)
         # check that conference exists
         if not conf:
             raise endpoints.BadRequestException(
@@ -346,59 +790,116 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner retrieve the attendees.')
 
-        q = Profile.query()
-        attendees = q.filter(Profile.conferenceKeysToAttend == wsck)
+        # projection over the registrations; no Profile is loaded
+        q = Registration.query(
+            Registration.conferenceKey == confKey,
+            projection=[Registration.displayName, Registration.teeShirtSize])
+        q = q.order(Registration.displayName)
+        attendees, nextPageToken = self._fetchPage(
+            q, request.limit, request.pageToken)
         return ProfileForms(
-            items=[self._copyProfileMiniToForm(prof)
-                   for prof in attendees
-                   ]
+            items=serializers.toMessages(attendees, ProfileMiniForm),
+            nextPageToken=nextPageToken
         )
 
+    # - - - Exports - - - - - - - - - - - - - - - - - - - - -
+
+    def _copyExportToForm(self, job):
+        """Copy an ExportJob to ExportForm, with its download URLs once
+        it has finished."""
+        return ExportForm(
+            websafeKey=job.key.urlsafe(),
+            websafeConferenceKey=job.conferenceKey.urlsafe(),
+            kind=job.kind,
+            format=job.format,
+            status=job.status,
+            rowCount=job.rowCount,
+            downloadUrls=export.downloadUrls(job))
+
+    @endpoints.method(EXPORT_POST_REQUEST, ExportForm,
+                      path='conference/{websafeConferenceKey}/export',
+                      http_method='POST', name='exportConference')
+    @metrics.instrument()
+    def exportConference(self, request):
+        """Start a background export of a conference's attendees or
+        sessions as csv or jsonl; poll getExport for the download."""
+        user_id = self._getUserId()
+        kind = request.kind or 'attendees'
+        fileFormat = request.format or 'csv'
+        if (kind not in export.COLUMNS or
+                fileFormat not in export.CONTENT_TYPES):
+            raise endpoints.BadRequestException(
+                "kind must be attendees or sessions and format csv or jsonl")
+        conf = cache.get(ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' %
+                request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can export a conference.')
+        return self._copyExportToForm(export.start(conf, kind, fileFormat))
+
+    @endpoints.method(EXPORT_GET_REQUEST, ExportForm,
+                      path='export/{websafeExportKey}',
+                      http_method='GET', name='getExport')
+    @metrics.instrument()
+    def getExport(self, request):
+        """Return the status of an export and, once it is DONE, the URLs
+        of its parts."""
+        user_id = self._getUserId()
+        job = ndb.Key(urlsafe=request.websafeExportKey).get()
+        if not isinstance(job, ExportJob):
+            raise endpoints.NotFoundException(
+                'No export found with key: %s' % request.websafeExportKey)
+        if user_id != job.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see an export.')
+        return self._copyExportToForm(job)
+
     # - - - Speakers - - - - - - - - - - - - - - - - - - - -
 
     def _copySpeakerToForm(self, speaker):
         """Copy relevant fields from Speaker to SpeakerForm."""
-        sf = SpeakerForm()
-        for field in sf.all_fields():
-            if hasattr(speaker, field.name):
-                setattr(sf, field.name, getattr(speaker, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, speaker.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return serializers.toMessage(speaker, SpeakerForm)
 
     @endpoints.method(SPEAKER_POST_REQUEST, BooleanMessage,
                       path='speakers/add',
                       http_method='POST',
                       name='addSpeaker')
+    @metrics.instrument()
     def addSpeaker(self, request):
         """Registers a new speaker"""
-        prof = self._getProfileFromUser()
+        # only signed-in users may add speakers
+        self._getUserId()
         data = {field.name: getattr(request, field.name) for field in
                 request.all_fields()}
         s_id = Speaker.allocate_ids(size=1)[0]
         speaker_key = ndb.Key(Speaker, s_id)
         data['key'] = speaker_key
-        Speaker(**data).put()
+        speaker = Speaker(**data)
+        speaker.put()
+        cache.invalidate(speaker_key)
+        textsearch.index([speaker])
         return BooleanMessage(data=True)
 
     @endpoints.method(message_types.VoidMessage, SpeakerForms,
                       path='speakers/get',
                       http_method='POST',
                       name='getSpeakers')
+    @metrics.instrument()
     def getSpeakers(self, request):
         """Returns a list of speakers"""
-        speakers = Speaker.query()
+        speakers = Speaker.query().fetch()
         return SpeakerForms(
-            items=[self._copySpeakerToForm(speaker)
-                   for speaker in speakers
-                   ]
+            items=serializers.toMessages(speakers, SpeakerForm)
         )
 
     @endpoints.method(CONF_GET_REQUEST, SpeakerForms,
                       path='speakers/getPresenters/{websafeConferenceKey}',
                       http_method='POST',
                       name='getPresenters')
+    @metrics.instrument()
     def getSpeakersByConference(self, request):
         """Returns a list of speakers presenting at a conference"""
         confKey = ndb.Key(urlsafe=request.websafeConferenceKey)
@@ -406,65 +907,253 @@ class ConferenceApi(remote.Service):
                                  distinct=True)
         speakerKeys = [(ndb.Key(urlsafe=sess.speakerKey))
                        for sess in sessions]
-        presenters = ndb.get_multi(speakerKeys)
+        presenters = cache.getMulti(speakerKeys)
         return SpeakerForms(
             items=[self._copySpeakerToForm(presenter)
                    for presenter in presenters
                    ]
         )
 
+    # - - - Seat shards - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _splitSeats(total, index):
+        """Return the share of total seats held by shard index."""
+        share, remainder = divmod(max(total or 0, 0), NUM_SEAT_SHARDS)
+        return share + (1 if index < remainder else 0)
+
+    @staticmethod
+    def _seatShardKeys(confKey):
+        """Return the SeatShard keys for a conference, in index order."""
+        wsck = confKey.urlsafe()
+        return [ndb.Key(SeatShard, '%s-%d' % (wsck, index))
+                for index in range(NUM_SEAT_SHARDS)]
+
+    @staticmethod
+    def _defaultSeatShard(conf, shardKey, index):
+        """Return the unsaved SeatShard derived from the Conference's
+        initial seat count, used until the shard is first written."""
+        return SeatShard(
+            key=shardKey,
+            capacity=ConferenceApi._splitSeats(conf.maxAttendees, index),
+            seatsAvailable=ConferenceApi._splitSeats(
+                conf.seatsAvailable, index))
+
+    @staticmethod
+    @ndb.tasklet
+    def _getStoredSeatShardsAsync(confKeys, **ctx_options):
+        """Tasklet returning, per conference key, the list of its stored
+        SeatShards (None where never written), using one get_multi."""
+        keys = []
+        for confKey in confKeys:
+            keys.extend(ConferenceApi._seatShardKeys(confKey))
+        stored = yield ndb.get_multi_async(keys, **ctx_options)
+        raise ndb.Return([
+            stored[n * NUM_SEAT_SHARDS:(n + 1) * NUM_SEAT_SHARDS]
+            for n in range(len(confKeys))])
+
+    @staticmethod
+    def _fillSeatShards(conf, stored):
+        """Return conf's SeatShards from its stored shards, deriving the
+        ones that have never been written."""
+        keys = ConferenceApi._seatShardKeys(conf.key)
+        return [stored[index] or ConferenceApi._defaultSeatShard(
+                    conf, keys[index], index)
+                for index in range(NUM_SEAT_SHARDS)]
+
+    @staticmethod
+    def _countSeats(conf, stored):
+        """Return the seats available for conf given its stored shards."""
+        return sum(shard.seatsAvailable for shard in
+                   ConferenceApi._fillSeatShards(conf, stored))
+
+    @staticmethod
+    @ndb.tasklet
+    def _getCachedSeatsAsync(confKeys):
+        """Tasklet returning the cached seats available for each of
+        confKeys, with None where it is not cached."""
+        ctx = ndb.get_context()
+        seats = yield [ctx.memcache_get(MEMCACHE_SEATS_KEY % key.urlsafe())
+                       for key in confKeys]
+        raise ndb.Return(seats)
+
+    @staticmethod
+    @ndb.tasklet
+    def _fillCachedSeatsAsync(confs, seats):
+        """Tasklet completing the cached seat counts of confs, summing
+        the seat shards of the conferences that were not cached (and
+        caching them) with one get_multi."""
+        missing = [conf for conf, count in zip(confs, seats)
+                   if conf and count is None]
+        if not missing:
+            raise ndb.Return(seats)
+        stored = yield ConferenceApi._getStoredSeatShardsAsync(
+            [conf.key for conf in missing])
+        counts = {}
+        for conf, shards in zip(missing, stored):
+            counts[conf.key] = ConferenceApi._countSeats(conf, shards)
+        ctx = ndb.get_context()
+        # add, so a count adjusted by a registration is not overwritten
+        yield [ctx.memcache_add(MEMCACHE_SEATS_KEY % key.urlsafe(), count,
+                                time=SEATS_TTL)
+               for key, count in counts.items()]
+        raise ndb.Return([
+            counts.get(conf.key, count) if conf else None
+            for conf, count in zip(confs, seats)])
+
+    @staticmethod
+    def _getSeatsAvailable(confs, **ctx_options):
+        """Return {conference key: seats available} aggregated over each
+        conference's seat shards."""
+        confs = [conf for conf in confs if conf]
+        stored = ConferenceApi._getStoredSeatShardsAsync(
+            [conf.key for conf in confs], **ctx_options).get_result()
+        return {conf.key: ConferenceApi._countSeats(conf, shards)
+                for conf, shards in zip(confs, stored)}
+
     # - - - Registration - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _newRegistration(prof, confKey):
+        """Return a new (unsaved) Registration of prof for confKey."""
+        return Registration(
+            key=ndb.Key(Registration, confKey.urlsafe(), parent=prof.key),
+            conferenceKey=confKey,
+            displayName=prof.displayName,
+            teeShirtSize=prof.teeShirtSize)
+
+    @staticmethod
+    def _getRegisteredConferenceKeys(prof):
+        """Return the websafe keys of the conferences prof is registered
+        for, including legacy registrations not yet migrated."""
+        regKeys = Registration.query(ancestor=prof.key).fetch(keys_only=True)
+        wscks = [regKey.id() for regKey in regKeys]
+        return wscks + [wsck for wsck in prof.conferenceKeysToAttend
+                        if wsck not in wscks]
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateRegistrations(p_key):
+        """Move the legacy Profile.conferenceKeysToAttend list into
+        Registration entities. The Profile and its Registrations share an
+        entity group, so this is a single-group transaction."""
+        prof = p_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return False
+        registrations = [
+            ConferenceApi._newRegistration(prof, ndb.Key(urlsafe=wsck))
+            for wsck in set(prof.conferenceKeysToAttend)]
+        prof.conferenceKeysToAttend = []
+        ndb.put_multi(registrations + [prof])
+        return True
+
+
     @ndb.transactional(xg=True)
+    def _updateSeatShard(self, prof, conf, index, reg):
+        """Move one seat between a seat shard and a user's Registration.
+
+        Returns True on success, False if the user was not registered
+        (unregister only) and None if the shard cannot take the change,
+        in which case the caller should try another shard."""
+        regKey = ndb.Key(Registration, conf.key.urlsafe(), parent=prof.key)
+        shardKey = self._seatShardKeys(conf.key)[index]
+        # prof is the request's Profile; the Registration shares its
+        # entity group, so a concurrent profile change still conflicts
+        registration, shard = ndb.get_multi([regKey, shardKey])
+        if not shard:
+            shard = self._defaultSeatShard(conf, shardKey, index)
+
+        # register
+        if reg:
+            # check if user already registered otherwise add
+            if registration:
+                raise ConflictException(
+                    "You have already registered for this conference")
+            if shard.seatsAvailable <= 0:
+                return None
+            # register user, take away one seat
+            shard.seatsAvailable -= 1
+            ndb.put_multi([self._newRegistration(prof, conf.key), shard])
+
+        # unregister
+        else:
+            if not registration:
+                return False
+            if shard.seatsAvailable >= shard.capacity:
+                return None
+            # unregister user, add back one seat
+            shard.seatsAvailable += 1
+            regKey.delete()
+            shard.put()
+        return True
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         prof = self._getProfileFromUser()  # get user Profile
+        wsck = request.websafeConferenceKey
+        confKey = ndb.Key(urlsafe=wsck)
+
+        # move any legacy registrations out of the Profile first
+        if prof.conferenceKeysToAttend:
+            if self._migrateRegistrations(prof.key):
+                cache.invalidate(prof.key)
+            prof.conferenceKeysToAttend = []
+
+        # the conference, the user's registration and the seat shards
+        # are independent lookups, so start them together
+        confFuture = cache.getAsync(confKey)
+        regFuture = ndb.Key(Registration, wsck, parent=prof.key).get_async()
+        shardsFuture = self._getStoredSeatShardsAsync([confKey])
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = confFuture.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
-        # register
-        if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
-
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+        registered = regFuture.get_result() is not None
+        if reg and registered:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not reg and not registered:
+            return BooleanMessage(data=False)
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
-        # unregister
+        # try the shards that can take the change in random order, so
+        # concurrent registrations spread over separate entity groups
+        shards = self._fillSeatShards(conf, shardsFuture.get_result()[0])
+        if reg:
+            candidates = [index for index, shard in enumerate(shards)
+                          if shard.seatsAvailable > 0]
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            candidates = [index for index, shard in enumerate(shards)
+                          if shard.seatsAvailable < shard.capacity]
+        random.shuffle(candidates)
+
+        for index in candidates:
+            retval = self._updateSeatShard(prof, conf, index, reg)
+            if retval is not None:
+                if retval:
+                    # adjust the list views' total, if it is cached
+                    if reg:
+                        memcache.decr(MEMCACHE_SEATS_KEY % wsck)
+                    else:
+                        memcache.incr(MEMCACHE_SEATS_KEY % wsck)
+                    cache.bumpVersions(VERSION_CONFERENCE % wsck,
+                                       VERSION_CONFERENCES,
+                                       VERSION_PROFILE % prof.key.id())
+                    self._updateAnnouncement(conf)
+                return BooleanMessage(data=retval)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        if reg:
+            raise ConflictException(
+                "There are no seats available.")
+        return BooleanMessage(data=False)
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @metrics.instrument()
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -472,77 +1161,200 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @metrics.instrument()
     def unregisterFromConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
+    @metrics.instrument()
     def getConferencesToAttend(self, request):
-        """Get list of conferences that user has registered for."""
+        """Get list of conferences that user has registered for; summary
+        returns only SUMMARY_FIELDS."""
         prof = self._getProfileFromUser()
         conf_keys = [ndb.Key(urlsafe=wsck)
-                     for wsck in prof.conferenceKeysToAttend]
-
-        conferences = ndb.get_multi(conf_keys)
+                     for wsck in self._getRegisteredConferenceKeys(prof)]
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in
-                      conferences]
-        profiles = ndb.get_multi(organisers)
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # conferences and seats are fetched concurrently
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf,
-                names[conf.organizerUserId])
-                   for conf in conferences]
+            items=self._getConferenceFormsAsync(
+                conf_keys, summary=bool(request.summary)).get_result()
         )
 
     # - - - Session objects - - - - - - - - - - - - - - - - - - -
     def _copySessionToForm(self, sess, conferenceName, speakerName):
         """Copy relevant fields from Session to SessionForm."""
-        session = SessionForm()
-        for field in session.all_fields():
-            if hasattr(sess, field.name):
-
-                if field.name.endswith('Date'):
-                    # convert Date to date string; just copy others
-                    setattr(
-                        session,
-                        field.name,
-                        str(getattr(sess, field.name)))
-                elif field.name.endswith('Time'):
-                    # convert Time to time string; just copy others
-                    setattr(
-                        session,
-                        field.name,
-                        str(getattr(sess, field.name)))
-                else:
-                    setattr(session, field.name, getattr(sess, field.name))
-            elif field.name == "websafeSessionKey":
-                setattr(session, field.name, sess.key.urlsafe())
+        session = serializers.toMessage(sess, SessionForm)
         if conferenceName:
-            setattr(session, 'conferenceName', conferenceName)
+            session.conferenceName = conferenceName
         if speakerName:
-            setattr(session, 'speakerName', speakerName)
-        session.check_initialized()
+            session.speakerName = speakerName
         return session
 
+    def _copySessionsToForms(self, sessions):
+        """Copy a list of Sessions to SessionForms. Names are stored on
+        the sessions; the conferences and speakers of sessions stored
+        before that are loaded for the whole list in one cached read."""
+        sessions = [sess for sess in sessions if sess]
+        keys = set()
+        for sess in sessions:
+            if sess.conferenceName is None:
+                keys.add(sess.key.parent())
+            if sess.speakerKey and sess.speakerName is None:
+                keys.add(ndb.Key(urlsafe=sess.speakerKey))
+        keys = list(keys)
+        entities = dict(zip(keys, cache.getMulti(keys))) if keys else {}
+
+        items = []
+        for sess in sessions:
+            conf = entities.get(sess.key.parent())
+            speaker = None
+            if sess.speakerKey and sess.speakerName is None:
+                speaker = entities.get(ndb.Key(urlsafe=sess.speakerKey))
+            items.append(self._copySessionToForm(
+                sess,
+                conf.name if conf else "",
+                speaker.speaker_name if speaker else ""))
+        return items
+
+    @staticmethod
+    def _getSpeakerNames(speakerKeys):
+        """Return a dict of websafe speaker key to speaker_name for the
+        speakers that exist, read in one cached call."""
+        keys = {}
+        for wssk in set(speakerKeys):
+            try:
+                keys[wssk] = ndb.Key(urlsafe=wssk)
+            except Exception:
+                continue
+        speakers = cache.getMulti(keys.values())
+        return dict((wssk, speaker.speaker_name)
+                    for wssk, speaker in zip(keys.keys(), speakers)
+                    if speaker)
+
+    @staticmethod
+    @ndb.transactional()
+    def _setSessionNames(keys, field, name):
+        """Set field to name on the Sessions keys, all in one entity
+        group, returning the sessions that did not have it yet."""
+        sessions = [sess for sess in ndb.get_multi(keys)
+                    if sess and getattr(sess, field) != name]
+        for sess in sessions:
+            setattr(sess, field, name)
+        ndb.put_multi(sessions)
+        return sessions
+
+    @staticmethod
+    def _updateSessionNamesBatch(websafeConferenceKey=None, speakerKey=None,
+                                 pageToken=None):
+        """Copy the current name of a conference (or speaker) onto one
+        page of its sessions, returning the cursor for the next page (or
+        None when done)."""
+        if websafeConferenceKey:
+            confKey = ndb.Key(urlsafe=websafeConferenceKey)
+            owner = confKey.get()
+            field = 'conferenceName'
+            name = owner.name if owner else None
+            q = Session.query(ancestor=confKey)
+        elif speakerKey:
+            owner = ndb.Key(urlsafe=speakerKey).get()
+            field = 'speakerName'
+            name = owner.speaker_name if owner else None
+            q = Session.query(Session.speakerKey == speakerKey)
+        else:
+            return None
+        if not owner:
+            return None
+        cursor = Cursor(urlsafe=pageToken) if pageToken else None
+        keys, next_cursor, more = q.fetch_page(
+            MAX_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+        # sessions are rewritten after creation (by backfills), so each
+        # entity group holding a stale session is updated in its own
+        # transaction that reads them again and never saves an older
+        # copy over a newer one; a speaker's sessions span many groups.
+        # A backfill batch saves the copies it read when it started, so
+        # renaming during a Session backfill can leave the old name on
+        # sessions: enqueue this task again once the backfill is done.
+        stale = {}
+        for sess in ndb.get_multi(keys):
+            if sess and getattr(sess, field) != name:
+                stale.setdefault(sess.key.parent(), []).append(sess.key)
+        confKeys = [confKey for confKey, sessKeys in stale.items()
+                    if ConferenceApi._setSessionNames(sessKeys, field, name)]
+        if confKeys:
+            cache.bumpVersions(*[VERSION_SESSIONS % confKey.urlsafe()
+                                 for confKey in confKeys])
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+    @staticmethod
+    @ndb.transactional()
+    def _putSessions(confKey, sessions):
+        """Save new sessions of one conference and add them to their
+        speakers' session counts, in the conference's entity group."""
+        added = {}
+        for session in sessions:
+            if session.speakerKey:
+                added[session.speakerKey] = (
+                    added.get(session.speakerKey, 0) + 1)
+
+        countKeys = [ndb.Key(SpeakerSessionCount, speakerKey, parent=confKey)
+                     for speakerKey in added]
+        counts = []
+        for countKey, count in zip(countKeys, ndb.get_multi(countKeys)):
+            if not count:
+                # first session counted for this speaker; start from the
+                # sessions stored before counts were kept
+                count = SpeakerSessionCount(
+                    key=countKey,
+                    sessionCount=Session.query(ancestor=confKey).filter(
+                        Session.speakerKey == countKey.id()).count())
+            count.sessionCount += added[countKey.id()]
+            counts.append(count)
+        ndb.put_multi(list(sessions) + counts)
+
+    @staticmethod
+    def _sessionDataFromForm(request):
+        """Validate a session request and return the Session property
+        dict for it."""
+        if not request.session_name or not request.typeOfSession:
+            raise endpoints.BadRequestException(
+                "Session 'session_name' and 'typeOfSession' fields required")
+        data = {field.name: getattr(request, field.name)
+                for field in request.all_fields()}
+        for name in ('websafeConferenceKey', 'conferenceName',
+                     'speakerName', 'websafeSessionKey'):
+            data.pop(name, None)
+
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(
+                    data['startDate'][:10], "%Y-%m-%d").date()
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(
+                    data['startTime'], "%H:%M").time()
+            if data['duration']:
+                data['duration'] = int(data['duration'])
+            else:
+                data['duration'] = 0
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Session startDate must be YYYY-MM-DD, startTime HH:MM "
+                "and duration a number of minutes")
+        return data
+
     @endpoints.method(SESSION_CREATE, SessionForm, path='session',
                       http_method='POST', name='createSession')
+    @metrics.instrument()
     def createSession(self, request):
         """Registers a new session"""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self._getUserId()
         confKey = ndb.Key(urlsafe=request.websafeConferenceKey)
-        conf = confKey.get()
+        conf = cache.get(confKey)
         # check that conference exists
         if not conf:
             raise endpoints.BadRequestException(
@@ -552,146 +1364,329 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can add sessions to a conference.')
-        data = {field.name: getattr(request, field.name)
-                for field in request.all_fields()}
-
-        del data['websafeConferenceKey']
-
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(
-                data['startDate'][:10], "%Y-%m-%d").date()
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(
-                data['startTime'], "%H:%M").time()
-        if data['duration']:
-            data['duration'] = int(data['duration'])
-        else:
-            data['duration'] = 0
+        data = self._sessionDataFromForm(request)
+        data['conferenceName'] = conf.name
+        if request.speakerKey:
+            data['speakerName'] = self._getSpeakerNames(
+                [request.speakerKey]).get(request.speakerKey)
 
         s_id = Session.allocate_ids(size=1, parent=confKey)[0]
         s_key = ndb.Key(Session, s_id, parent=confKey)
         data['key'] = s_key
         session = Session(**data)
-        session.put()
+        self._putSessions(confKey, [session])
+        cache.bumpVersions(VERSION_SESSIONS % request.websafeConferenceKey)
+        textsearch.index([session])
 
         # set featured speaker
-        taskqueue.add(params={'speakerKey': request.speakerKey,
-                              'conferenceKey': request.websafeConferenceKey},
-                      url='/tasks/set_featured_speaker'
-                      )
-
-        return self._copySessionToForm(session, "", "")
-
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+        if request.speakerKey:
+            taskqueue.add(params={'speakerKey': request.speakerKey,
+                                  'conferenceKey':
+                                      request.websafeConferenceKey},
+                          url='/tasks/set_featured_speaker'
+                          )
+
+        return self._copySessionToForm(session, None, None)
+
+    @endpoints.method(SessionForms, BatchResultForms,
+                      path='sessions/batch',
+                      http_method='POST', name='createSessions')
+    @metrics.instrument()
+    def createSessions(self, request):
+        """Create up to MAX_BATCH_SIZE sessions, across any conferences
+        owned by the user, reporting the outcome of each item."""
+        user_id = self._getUserId()
+        if len(request.items) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                "At most %d sessions per batch" % MAX_BATCH_SIZE)
+
+        # load every referenced conference at once
+        confKeys = {}
+        for form in request.items:
+            wsck = form.websafeConferenceKey
+            if wsck and wsck not in confKeys:
+                try:
+                    confKeys[wsck] = ndb.Key(urlsafe=wsck)
+                except Exception:
+                    confKeys[wsck] = None
+        validKeys = [key for key in confKeys.values() if key]
+        conferences = dict(zip(validKeys, cache.getMulti(validKeys)))
+
+        # validate each form and group the valid ones by conference
+        results = {}
+        byConference = {}
+        for index, form in enumerate(request.items):
+            confKey = confKeys.get(form.websafeConferenceKey)
+            conf = conferences.get(confKey) if confKey else None
+            try:
+                if not conf:
+                    raise endpoints.BadRequestException(
+                        'No conference found with key: %s' %
+                        form.websafeConferenceKey)
+                if user_id != conf.organizerUserId:
+                    raise endpoints.ForbiddenException(
+                        'Only the owner can add sessions to a conference.')
+                data = self._sessionDataFromForm(form)
+            except (endpoints.BadRequestException,
+                    endpoints.ForbiddenException) as e:
+                results[index] = BatchResultForm(index=index, error=str(e))
+                continue
+            data['conferenceName'] = conf.name
+            byConference.setdefault(confKey, []).append((index, data))
+
+        # store speaker names with the sessions, loaded once per speaker
+        speakerNames = self._getSpeakerNames(
+            [data['speakerKey'] for items in byConference.values()
+             for index, data in items if data['speakerKey']])
+        tasks = {}
+        created = []
+        for confKey, items in byConference.items():
+            # one ID allocation and one transaction per conference
+            first, last = Session.allocate_ids(
+                size=len(items), parent=confKey)
+            sessions = []
+            for (index, data), s_id in zip(items, range(first, last + 1)):
+                data['key'] = ndb.Key(Session, s_id, parent=confKey)
+                data['speakerName'] = speakerNames.get(data['speakerKey'])
+                sessions.append(Session(**data))
+            self._putSessions(confKey, sessions)
+            cache.bumpVersions(VERSION_SESSIONS % confKey.urlsafe())
+            created.extend(sessions)
+
+            for (index, data), session in zip(items, sessions):
+                results[index] = BatchResultForm(
+                    index=index, websafeKey=session.key.urlsafe())
+                if session.speakerKey:
+                    # one featured speaker update per speaker
+                    tasks[(confKey, session.speakerKey)] = taskqueue.Task(
+                        params={'speakerKey': session.speakerKey,
+                                'conferenceKey': confKey.urlsafe()},
+                        url='/tasks/set_featured_speaker')
+
+        textsearch.index(created)
+        # set featured speakers
+        if tasks:
+            taskqueue.Queue().add(tasks.values())
+
+        return BatchResultForms(
+            items=[results[index] for index in sorted(results)])
+
+    @endpoints.method(CONF_CONDITIONAL_GET_REQUEST, SessionForms,
                       path='getConferenceSessions/{websafeConferenceKey}',
                       http_method='POST',
                       name='getConferenceSessions')
+    @metrics.instrument()
     def getConferenceSessions(self, request):
-        """Given a conference, returns all sessions."""
-        confKey = ndb.Key(urlsafe=request.websafeConferenceKey)
+        """Given a conference, returns all sessions, or a notModified
+        reply if they still match the ifNoneMatch etag."""
+        wsck = request.websafeConferenceKey
+        etag = cache.versionToken(VERSION_SESSIONS % wsck,
+                                  VERSION_CONFERENCE % wsck)
+        if etag and etag == request.ifNoneMatch:
+            return SessionForms(etag=etag, notModified=True)
+
+        confKey = ndb.Key(urlsafe=wsck)
         sessions = Session.query(ancestor=confKey)
-        conferenceName = confKey.get().name
-        return SessionForms(
-            items=[self._copySessionToForm(
-                sess, 
-                conferenceName, 
-                ndb.Key(urlsafe=sess.speakerKey).get().speaker_name)
-                   for sess in sessions]
-        )
+        return SessionForms(items=self._copySessionsToForms(sessions),
+                            etag=etag)
 
     @endpoints.method(SESSION_TYPE_GET_REQUEST, SessionForms,
                       path='getConferenceSessionsByType/{websafeConferenceKey}/{typeOfSession}',  # noqa
                       http_method='POST',
                       name='getConferenceSessionsByType')
+    @metrics.instrument()
     def getConferenceSessionsByType(self, request):
         """Given a conference, return all sessions of a specified type
         (eg lecture, keynote, workshop)"""
         confKey = ndb.Key(urlsafe=request.websafeConferenceKey)
         sessions = Session.query(ancestor=confKey).filter(
             Session.typeOfSession == request.typeOfSession)
-        conferenceName = confKey.get().name
-        return SessionForms(
-            items=[self._copySessionToForm(sess, conferenceName, ndb.Key(
-                urlsafe=sess.speakerKey).get().speaker_name)
-                   for sess in sessions]
-        )
+        return SessionForms(items=self._copySessionsToForms(sessions))
 
     @endpoints.method(SESSION_SPEAKER_GET_REQUEST, SessionForms,
                       path='getSessionsBySpeaker/{speakerKey}',
                       http_method='GET',
                       name='getSessionsBySpeaker')
+    @metrics.instrument()
     def getSessionsBySpeaker(self, request):
         """Given a speaker, return all sessions given by this
         particular speaker, across all conferences"""
         wssk = request.speakerKey
 
         sessions = Session.query().filter(Session.speakerKey == wssk)
-        speaker = ndb.Key(urlsafe=wssk).get()
-        return SessionForms(
-            items=[self._copySessionToForm(
-                sess,
-                sess.key.parent().get().name,
-                speaker.speaker_name)
-                   for sess in sessions]
-        )
+        return SessionForms(items=self._copySessionsToForms(sessions))
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(PAGE_REQUEST, SessionForms,
                       path='getSessionByTypeAndTime',
                       http_method='GET',
                       name='getSessionByTypeAndTime')
+    @metrics.instrument()
     def getSessionByTypeAndTime(self, request):
-        """Returns all sessions that are not workshops and are before 19:00"""
-        sessions = Session.query(Session.typeOfSession != "workshop").fetch()
-        validSessions = []
-        for sess in sessions:
-            if sess.startTime < datetime.strptime("19:00", "%H:%M").time():
-                validSessions.append(sess)
+        """Returns sessions that are not workshops and are before 19:00,
+        a page at a time"""
+        q = self._getSessionSearchQuery(
+            excludeTypes=["workshop"], startBefore="19:00")
+        if q is None:
+            return SessionForms(items=[])
+        sessions, nextPageToken = self._fetchPage(
+            q, request.limit, request.pageToken)
+        return SessionForms(items=self._copySessionsToForms(sessions),
+                            nextPageToken=nextPageToken)
 
-        return SessionForms(
-            items=[self._copySessionToForm(
-                sess,
-                sess.key.parent().get().name,
-                ndb.Key(urlsafe=sess.speakerKey).get().speaker_name)
-                   for sess in validSessions]
-        )
+    @staticmethod
+    def _parseMinutes(value):
+        """Convert a HH:MM string to minutes since midnight."""
+        try:
+            t = datetime.strptime(value, "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Invalid time '%s', expected HH:MM" % value)
+        return t.hour * 60 + t.minute
+
+    def _getSessionSearchQuery(self, websafeConferenceKey=None,
+                               typeOfSession=None, excludeTypes=None,
+                               startAfter=None, startBefore=None,
+                               duration=None, startDate=None):
+        """Return a Session query for the search criteria. Every filter
+        runs on an indexed property: type exclusion becomes an IN over
+        the remaining session types, and the start-time window is the
+        one inequality, on startMinutes."""
+        ancestor = None
+        if websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=websafeConferenceKey)
+        q = Session.query(ancestor=ancestor)
+
+        if startDate:
+            try:
+                day = datetime.strptime(startDate[:10], "%Y-%m-%d").date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Invalid startDate '%s', expected YYYY-MM-DD" %
+                    startDate)
+            q = q.filter(Session.startDate == day)
+        if duration is not None:
+            q = q.filter(Session.duration == duration)
+
+        if typeOfSession or excludeTypes:
+            excluded = set(t.strip().lower() for t in excludeTypes or [])
+            if typeOfSession:
+                types = set([typeOfSession.strip().lower()])
+            else:
+                # the distinct session types come from the typeKey index
+                types = set(sess.typeKey for sess in Session.query(
+                    ancestor=ancestor, projection=[Session.typeKey],
+                    distinct=True))
+            types = sorted(types - excluded)
+            if not types:
+                return None
+            q = q.filter(Session.typeKey.IN(types))
+
+        if startAfter:
+            startAfter = self._parseMinutes(startAfter)
+            q = q.filter(Session.startMinutes >= startAfter)
+        if startBefore:
+            startBefore = self._parseMinutes(startBefore)
+            q = q.filter(Session.startMinutes < startBefore)
+
+        # ordering by key as well keeps cursors valid for IN queries
+        return q.order(Session.startMinutes, Session.key)
+
+    @endpoints.method(SESSION_SEARCH_REQUEST, SessionForms,
+                      path='searchSessions',
+                      http_method='POST',
+                      name='searchSessions')
+    @metrics.instrument()
+    def searchSessions(self, request):
+        """Search sessions by type, excluded types, start-time window
+        (HH:MM, startAfter inclusive, startBefore exclusive), duration
+        and date, optionally within one conference."""
+        q = self._getSessionSearchQuery(
+            websafeConferenceKey=request.websafeConferenceKey,
+            typeOfSession=request.typeOfSession,
+            excludeTypes=request.excludeTypes,
+            startAfter=request.startAfter,
+            startBefore=request.startBefore,
+            duration=request.duration,
+            startDate=request.startDate)
+        if q is None:
+            return SessionForms(items=[])
+        sessions, nextPageToken = self._fetchPage(
+            q, request.limit, request.pageToken)
+        return SessionForms(items=self._copySessionsToForms(sessions),
+                            nextPageToken=nextPageToken)
+
+    # - - - Full-text search - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(TEXT_SEARCH_REQUEST, SearchResultForms,
+                      path='search',
+                      http_method='GET',
+                      name='search')
+    @metrics.instrument()
+    def search(self, request):
+        """Ranked full-text search over conference names, descriptions
+        and topics, session names and highlights and speaker names and
+        bios; kind limits it to conference, session or speaker."""
+        limit = request.limit
+        if not limit or limit <= 0:
+            limit = DEFAULT_PAGE_SIZE
+        try:
+            hits, nextPageToken = textsearch.search(
+                request.query, kind=request.kind,
+                limit=min(limit, MAX_PAGE_SIZE),
+                pageToken=request.pageToken)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        return SearchResultForms(
+            items=[SearchResultForm(**hit) for hit in hits],
+            nextPageToken=nextPageToken)
 
     # - - - Wishlist objects - - - - - - - - - - - - - - - - - - -
 
-    def _wishlistRegistration(self, request, add=True):
-        """Adds or Removes a session from the users wishlist"""
-        retval = False
-        prof = self._getProfileFromUser()
-        sessionKey = request.sessionKey
-        session = ndb.Key(urlsafe=sessionKey).get()
-        
+    @staticmethod
+    @ndb.transactional()
+    def _updateWishlist(p_key, sessionKey, add):
+        """Add sessionKey to or remove it from the stored Profile's
+        wishlist, returning the saved Profile."""
+        prof = p_key.get()
         if add:
-            if not session:
-                raise endpoints.NotFoundException(
-                    'No session found with key: %s' % sessionKey)
             # check if session is already in wishlist
             if sessionKey in prof.sessionWishlist:
                 raise ConflictException(
                     "This session is already in your wishlist")
             # if not in wishlist add
             prof.sessionWishlist.append(sessionKey)
-            retval = True
         else:
             # check if session is in wishlist
             if sessionKey in prof.sessionWishlist:
                 # remove session
                 prof.sessionWishlist.remove(sessionKey)
-                retval = True
             else:
                 # raise exception for the session not existing in the list
                 raise ConflictException(
                     "This session does not exist in the wishlist")
         # save data back to datastore
         prof.put()
-        return BooleanMessage(data=retval)
+        return prof
+
+    def _wishlistRegistration(self, request, add=True):
+        """Adds or Removes a session from the users wishlist"""
+        prof = self._getProfileFromUser()
+        sessionKey = request.sessionKey
+        if add:
+            session = ndb.Key(urlsafe=sessionKey).get()
+            if not session:
+                raise endpoints.NotFoundException(
+                    'No session found with key: %s' % sessionKey)
+        prof = self._profile = self._updateWishlist(
+            prof.key, sessionKey, add)
+        cache.invalidate(prof.key)
+        cache.bumpVersions(VERSION_PROFILE % prof.key.id())
+        return BooleanMessage(data=True)
 
     @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
                       path='addSessionToWishlist/{sessionKey}',
                       http_method='POST', name='addSessionToWishlist')
+    @metrics.instrument()
     def addSessionToWishlist(self, request):
         """Add session to users wishlist."""
         return self._wishlistRegistration(request)
@@ -699,6 +1694,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
                       path='removeSessionFromWishlist/{sessionKey}',
                       http_method='POST', name='removeSessionFromWishlist')
+    @metrics.instrument()
     def removeSessionFromWishlist(self, request):
         """Remove session from users wishlist."""
         return self._wishlistRegistration(request, add=False)
@@ -706,99 +1702,168 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='getSessionsInWishlist',
                       http_method='POST', name='getSessionsInWishlist')
+    @metrics.instrument()
     def getSessionsInWishlist(self, request):
         """Gets sessions in users wishlist."""
         prof = self._getProfileFromUser()  # get user Profile
         sess_keys = [ndb.Key(urlsafe=sessionKey)
                      for sessionKey in prof.sessionWishlist]
         sessions = ndb.get_multi(sess_keys)
-        return SessionForms(
-            items=[self._copySessionToForm(
-                sess,
-                sess.key.parent().get().name,
-                ndb.Key(urlsafe=sess.speakerKey).get().speaker_name)
-                   for sess in sessions]
-        )
+        return SessionForms(items=self._copySessionsToForms(sessions))
 
     # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name,
-                            getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        # t-shirt string is converted to its Enum by the serializer
+        pf = serializers.toMessage(prof, ProfileForm)
+        pf.conferenceKeysToAttend = self._getRegisteredConferenceKeys(prof)
         return pf
 
     def _copyProfileMiniToForm(self, prof):
-        """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileMiniForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name,
-                            getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
-
-    def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if
-        non-existent."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        """Copy relevant fields from Profile (or Registration) to
+        ProfileMiniForm."""
+        return serializers.toMessage(prof, ProfileMiniForm)
+
+    def _getUser(self):
+        """Return the signed-in user, resolved once per request."""
+        if self._user is None:
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException(
+                    'Authorization required')
+            self._user = user
+        return self._user
+
+    def _getUserId(self):
+        """Return the signed-in user's id, resolved once per request."""
+        if self._userId is None:
+            self._userId = getUserId(self._getUser())
+        return self._userId
+
+    def _getProfileFromUser(self, local=True):
+        """Return user Profile, creating new one if non-existent. It is
+        read through the entity cache once per request; local=False reads
+        past the instance cache tier."""
+        if self._profile is not None:
+            return self._profile
+        user = self._getUser()
+        p_key = ndb.Key(Profile, self._getUserId())
+        profile = cache.get(p_key, local=local)
         if not profile:
-            profile = Profile(
-                key=p_key,
+            # first login; concurrent requests all get the same Profile
+            profile = Profile.get_or_insert(
+                p_key.id(),
                 displayName=user.nickname(),
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+        self._profile = profile
         return profile  # return Profile
 
-    def _doProfile(self, save_request=None):
+    @staticmethod
+    @ndb.transactional()
+    def _putProfile(p_key, values):
+        """Apply the field values to the stored Profile, save it and copy
+        its display fields onto the user's Registrations, which live in
+        the same entity group. A changed displayName is copied onto the
+        user's conferences by a task enqueued with the commit. Returns
+        the saved Profile."""
+        prof = p_key.get()
+        nameChanged = values.get('displayName', prof.displayName) != (
+            prof.displayName)
+        for field, value in values.items():
+            setattr(prof, field, value)
+        registrations = Registration.query(ancestor=prof.key).fetch()
+        for registration in registrations:
+            registration.displayName = prof.displayName
+            registration.teeShirtSize = prof.teeShirtSize
+        ndb.put_multi(registrations + [prof])
+        if nameChanged:
+            taskqueue.add(params={'userId': prof.key.id()},
+                          url='/tasks/update_organizer_name',
+                          transactional=True
+                          )
+        return prof
+
+    @staticmethod
+    @ndb.transactional()
+    def _setOrganizerName(confKeys, displayName):
+        """Set organizerDisplayName on conferences of one organiser,
+        returning the keys of those that changed."""
+        confs = [conf for conf in ndb.get_multi(confKeys)
+                 if conf and conf.organizerDisplayName != displayName]
+        for conf in confs:
+            conf.organizerDisplayName = displayName
+        ndb.put_multi(confs)
+        return [conf.key for conf in confs]
+
+    @staticmethod
+    def _updateOrganizerNameBatch(userId, pageToken=None):
+        """Copy the organiser's current displayName onto one page of
+        their conferences, returning the cursor for the next page (or
+        None when done)."""
+        p_key = ndb.Key(Profile, userId)
+        prof = p_key.get()
+        if not prof:
+            return None
+        cursor = Cursor(urlsafe=pageToken) if pageToken else None
+        confKeys, next_cursor, more = Conference.query(
+            ancestor=p_key).fetch_page(
+                MAX_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+        updated = ConferenceApi._setOrganizerName(confKeys,
+                                                  prof.displayName)
+        if updated:
+            cache.invalidate(*updated)
+            cache.bumpVersions(VERSION_CONFERENCES,
+                               *[VERSION_CONFERENCE % confKey.urlsafe()
+                                 for confKey in updated])
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+    def _doProfile(self, save_request=None, local=True):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
-        prof = self._getProfileFromUser()
+        prof = self._getProfileFromUser(local)
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            values = {}
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
-                        setattr(prof, field, str(val))
-                        prof.put()
+                        values[field] = str(val)
+            if values:
+                # applied to the stored Profile, which may be newer
+                # than the cached one
+                prof = self._profile = self._putProfile(prof.key, values)
+                cache.invalidate(prof.key)
+                cache.bumpVersions(VERSION_PROFILE % prof.key.id())
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @endpoints.method(PROFILE_GET_REQUEST, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
+    @metrics.instrument()
     def getProfile(self, request):
-        """Return user profile."""
-        return self._doProfile()
+        """Return user profile, or a notModified reply if it still
+        matches the ifNoneMatch etag."""
+        etag = cache.versionToken(VERSION_PROFILE % self._getUserId())
+        if etag and etag == request.ifNoneMatch:
+            return ProfileForm(etag=etag, notModified=True)
+        # the instance cache tier may be older than the etag
+        pf = self._doProfile(local=False)
+        pf.etag = etag
+        return pf
 
     # TODO 1
     # 1. change request class
     # 2. pass request to _doProfile function
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile', http_method='POST', name='saveProfile')
+    @metrics.instrument()
     def saveProfile(self, request):
         """Update & return user profile."""
 
@@ -807,69 +1872,168 @@ class ConferenceApi(remote.Service):
     # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    def _formatAnnouncement(names):
+        """Return the announcement text for nearly sold out conferences."""
+        if not names:
+            return ""
+        return '%s %s' % (
+            'Last chance to attend! The following conferences '
+            'are nearly sold out:',
+            ', '.join(names))
+
+    @staticmethod
+    @ndb.transactional()
+    def _setNearlySoldOut(conf, nearlySoldOut):
+        """Add conf to or remove it from the stored announcement,
+        returning the Announcement."""
+        key = ndb.Key(Announcement, ANNOUNCEMENT_ID)
+        announcement = key.get() or Announcement(key=key)
+        wsck = conf.key.urlsafe()
+        if (wsck in announcement.conferenceKeys) == nearlySoldOut:
+            return announcement
+        if nearlySoldOut:
+            announcement.conferenceKeys.append(wsck)
+            announcement.conferenceNames.append(conf.name)
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+            index = announcement.conferenceKeys.index(wsck)
+            del announcement.conferenceKeys[index]
+            del announcement.conferenceNames[index]
+        announcement.put()
+        return announcement
+
+    @staticmethod
+    def _updateAnnouncement(conf):
+        """Keep the announcement in step after a registration change to
+        conf. The decision uses the committed seat shards, read after
+        the change: a count from before it can be off by any number of
+        concurrent registrations on other shards. The announcement is
+        rewritten only when conf crosses the threshold."""
+        # skip the context cache, which still holds the shards this
+        # request read before the change
+        seats = ConferenceApi._getSeatsAvailable(
+            [conf], use_cache=False)[conf.key]
+        nearlySoldOut = 0 < seats <= NEARLY_SOLD_OUT_SEATS
+        stored = ndb.Key(Announcement, ANNOUNCEMENT_ID).get()
+        listed = bool(stored and conf.key.urlsafe() in stored.conferenceKeys)
+        if listed != nearlySoldOut:
+            announcement = ConferenceApi._setNearlySoldOut(conf, nearlySoldOut)
+            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY,
+                         ConferenceApi._formatAnnouncement(
+                             announcement.conferenceNames))
 
+    @staticmethod
+    def _cacheAnnouncement():
+        """Rebuild the Announcement from every conference's seat count,
+        store it & assign to memcache; used by the memcache cron job to
+        repair the copy kept up to date by registrations.
+        """
+        # live seat counts are held in the seat shards, so aggregate
+        # them for every conference that has seats at all
+        confs = Conference.query(Conference.maxAttendees > 0).fetch()
+        nearlySoldOut = []
+        for i in range(0, len(confs), MAX_PAGE_SIZE):
+            batch = confs[i:i + MAX_PAGE_SIZE]
+            seats = ConferenceApi._getSeatsAvailable(batch)
+            nearlySoldOut.extend(
+                conf for conf in batch
+                if 0 < seats[conf.key] <= NEARLY_SOLD_OUT_SEATS)
+
+        Announcement(
+            key=ndb.Key(Announcement, ANNOUNCEMENT_ID),
+            conferenceKeys=[conf.key.urlsafe() for conf in nearlySoldOut],
+            conferenceNames=[conf.name for conf in nearlySoldOut]).put()
+        announcement = ConferenceApi._formatAnnouncement(
+            [conf.name for conf in nearlySoldOut])
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         return announcement
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
+    @metrics.instrument()
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
+        if announcement is None:
+            # fall back to the stored announcement and re-cache it
+            stored = ndb.Key(Announcement, ANNOUNCEMENT_ID).get()
+            announcement = self._formatAnnouncement(
+                stored.conferenceNames if stored else [])
+            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         return StringMessage(data=announcement)
 
     # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _formatFeaturedSpeaker(featured):
+        """Return the featured speaker announcement for featured."""
+        if not featured or featured.sessionCount <= 1:
+            return ""
+        return '%s %s' % (
+            'The featured speaker for this conference is: ',
+            featured.speakerName)
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateFeaturedSpeaker(confKey, speakerKey, speakerName):
+        """Make speakerKey the conference's featured speaker if their
+        session count now exceeds the current featured speaker's."""
+        countKey = ndb.Key(SpeakerSessionCount, speakerKey, parent=confKey)
+        featuredKey = ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                              parent=confKey)
+        count, featured = ndb.get_multi([countKey, featuredKey])
+        if not count:
+            return featured
+        if not featured:
+            featured = FeaturedSpeaker(key=featuredKey)
+        if (featured.speakerKey == speakerKey or
+                count.sessionCount > featured.sessionCount):
+            featured.speakerKey = speakerKey
+            featured.speakerName = speakerName
+            featured.sessionCount = count.sessionCount
+            featured.put()
+        return featured
+
     @staticmethod
     def _cacheFeaturedSpeaker(speakerKey, conferenceKey):
-        """Check if speaker has another session at the same conference
+        """Update the featured speaker for a conference after a session
+        by speakerKey was added, and refresh it in memcache.
         """
-        speakerKey = speakerKey
-        confKey = ndb.Key(urlsafe=conferenceKey)
-        query = Session.query(ancestor=confKey)
-        sessionCount = query.filter(Session.speakerKey == speakerKey).count()
-        featuredSpeaker = ""
-        if sessionCount > 1:
-            sKey = ndb.Key(urlsafe=speakerKey)
-            speaker = sKey.get()
-            featuredSpeaker = '%s %s' % (
-                'The featured speaker for this conference is: ',
-                speaker.speaker_name)
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featuredSpeaker)
+        if not speakerKey or speakerKey == 'None':
+            return ""
+        try:
+            confKey = ndb.Key(urlsafe=conferenceKey)
+            speaker = cache.get(ndb.Key(urlsafe=speakerKey))
+        except Exception:
+            # a malformed key would fail every retry of the task
+            return ""
+        if not speaker:
+            return ""
+        featured = ConferenceApi._updateFeaturedSpeaker(
+            confKey, speakerKey, speaker.speaker_name)
+        featuredSpeaker = ConferenceApi._formatFeaturedSpeaker(featured)
+        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY % conferenceKey,
+                     featuredSpeaker)
         return featuredSpeaker
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(CONF_GET_REQUEST, StringMessage,
                       path='conference/speaker/get',
                       http_method='GET', name='getFeaturedSpeaker')
+    @metrics.instrument()
     def getFeaturedSpeaker(self, request):
-        """Return Featured Speaker from memcache."""
-        featuredSpeaker = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
-        if not featuredSpeaker:
-            featuredSpeaker = ""
+        """Return Featured Speaker for a conference, from memcache."""
+        wsck = request.websafeConferenceKey
+        if not wsck:
+            raise endpoints.BadRequestException(
+                "'websafeConferenceKey' field required")
+        featuredSpeaker = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY % wsck)
+        if featuredSpeaker is None:
+            # fall back to the stored featured speaker and re-cache it
+            featured = ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                               parent=ndb.Key(urlsafe=wsck)).get()
+            featuredSpeaker = self._formatFeaturedSpeaker(featured)
+            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY % wsck,
+                         featuredSpeaker)
         return StringMessage(data=featuredSpeaker)
 
 
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Background export of a conference's attendees or sessions as CSV or
+JSON Lines.
+
+start() creates an ExportJob and enqueues /tasks/export. Each task writes
+the next CHUNK_ROWS rows, read with a query cursor, as one ExportChunk
+entity and enqueues the task for the next chunk. Saving the chunk,
+moving the job's cursor and enqueueing the next task happen in one
+transaction, so retried tasks never write a chunk twice. The finished
+file is the job's chunks in order. It is downloaded in parts of up to
+PART_CHUNKS chunks. webapp2 buffers a response until the handler
+returns, so one whole part is held in memory while it is sent;
+PART_CHUNKS keeps that, and the response, well under the instance
+memory and response size limits.
+
+"""
+
+import csv
+import hmac
+import json
+import os
+from datetime import datetime
+from StringIO import StringIO
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import cache
+from models import ExportChunk
+from models import ExportJob
+from models import Registration
+from models import Session
+
+CHUNK_ROWS = 250
+PART_CHUNKS = 20
+# chunks read per datastore call while downloading
+READ_BATCH = 5
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+DOWNLOAD_URL = '/exports/download?export=%s&token=%s&part=%d'
+
+COLUMNS = {
+    'attendees': ('displayName', 'teeShirtSize', 'registered'),
+    'sessions': ('websafeSessionKey', 'session_name', 'typeOfSession',
+                 'speakerKey', 'speakerName', 'startDate', 'startTime',
+                 'duration', 'highlights'),
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _query(job):
+    if job.kind == 'attendees':
+        return Registration.query(
+            Registration.conferenceKey == job.conferenceKey)
+    return Session.query(ancestor=job.conferenceKey)
+
+
+def _attendeeRows(registrations):
+    return [{'displayName': reg.displayName,
+             'teeShirtSize': reg.teeShirtSize,
+             'registered': reg.created}
+            for reg in registrations]
+
+
+def _sessionRows(sessions):
+    # sessions stored before speakerName was kept need their speakers
+    missing = set(sess.speakerKey for sess in sessions
+                  if sess.speakerKey and sess.speakerName is None)
+    names = {}
+    if missing:
+        keys = [ndb.Key(urlsafe=wssk) for wssk in missing]
+        names = dict((key.urlsafe(), speaker.speaker_name)
+                     for key, speaker in zip(keys, cache.getMulti(keys))
+                     if speaker)
+    return [{'websafeSessionKey': sess.key.urlsafe(),
+             'session_name': sess.session_name,
+             'typeOfSession': sess.typeOfSession,
+             'speakerKey': sess.speakerKey,
+             'speakerName': (sess.speakerName if sess.speakerName is not None
+                             else names.get(sess.speakerKey)),
+             'startDate': sess.startDate,
+             'startTime': sess.startTime,
+             'duration': sess.duration,
+             'highlights': sess.highlights}
+            for sess in sessions]
+
+
+def _text(value):
+    if value is None:
+        return u''
+    if isinstance(value, unicode):
+        return value
+    return unicode(str(value), 'utf-8')
+
+
+def _jsonValue(value):
+    if value is None or isinstance(value, (int, long)):
+        return value
+    return _text(value)
+
+
+def _encode(job, entities, header):
+    """Return the bytes of the rows for entities, with the CSV header
+    row first if header is set."""
+    if job.kind == 'attendees':
+        rows = _attendeeRows(entities)
+    else:
+        rows = _sessionRows(entities)
+    columns = COLUMNS[job.kind]
+    out = StringIO()
+    if job.format == 'csv':
+        writer = csv.writer(out)
+        if header:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_text(row[name]).encode('utf-8')
+                             for name in columns])
+    else:
+        for row in rows:
+            out.write(json.dumps(dict((name, _jsonValue(row[name]))
+                                      for name in columns)))
+            out.write('\n')
+    return out.getvalue()
+
+
+def _enqueue(jobKey):
+    taskqueue.add(params={'export': jobKey.urlsafe()},
+                  url='/tasks/export',
+                  transactional=True
+                  )
+
+
+@ndb.transactional()
+def _startJob(job):
+    job.put()
+    _enqueue(job.key)
+    return job
+
+
+def start(conf, kind, format):
+    """Create and start an export of conf's attendees or sessions,
+    returning the ExportJob."""
+    job = ExportJob(
+        conferenceKey=conf.key,
+        organizerUserId=conf.organizerUserId,
+        kind=kind,
+        format=format,
+        downloadToken=os.urandom(16).encode('hex'))
+    job.key = ndb.Key(ExportJob, ExportJob.allocate_ids(size=1)[0])
+    return _startJob(job)
+
+
+@ndb.transactional()
+def _saveChunk(jobKey, startCursor, data, rows, nextCursor):
+    job = jobKey.get()
+    if job.status != RUNNING or job.cursor != startCursor:
+        # a retried task already saved this chunk
+        return
+    job.chunkCount += 1
+    job.rowCount += rows
+    job.cursor = nextCursor
+    if nextCursor:
+        _enqueue(jobKey)
+    else:
+        job.status = DONE
+        job.finished = datetime.now()
+    ndb.put_multi([job, ExportChunk(id=job.chunkCount, parent=jobKey,
+                                    data=data)])
+
+
+def exportChunk(websafeJobKey):
+    """Write the next chunk of an export; run by /tasks/export."""
+    jobKey = ndb.Key(urlsafe=websafeJobKey)
+    job = jobKey.get()
+    if not job or job.status != RUNNING:
+        return
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = _query(job).fetch_page(
+        CHUNK_ROWS, start_cursor=cursor)
+    data = _encode(job, entities, header=not job.chunkCount)
+    _saveChunk(jobKey, job.cursor, data, len(entities),
+               next_cursor.urlsafe() if more and next_cursor else None)
+
+
+def partCount(job):
+    """Return the number of download parts of a finished export."""
+    if job.status != DONE:
+        return 0
+    return max((job.chunkCount + PART_CHUNKS - 1) // PART_CHUNKS, 1)
+
+
+def downloadUrls(job):
+    """Return the download URL of every part of a finished export."""
+    return [DOWNLOAD_URL % (job.key.urlsafe(), job.downloadToken, part)
+            for part in range(partCount(job))]
+
+
+def readPart(websafeJobKey, token, part):
+    """Return (job, chunk data iterator) for one download part, or
+    (None, None) if the export, token or part is not valid."""
+    try:
+        job = ndb.Key(urlsafe=websafeJobKey).get()
+    except Exception:
+        return None, None
+    if (not job or not isinstance(job, ExportJob) or
+            not hmac.compare_digest(str(job.downloadToken), str(token)) or
+            not 0 <= part < partCount(job)):
+        return None, None
+
+    def chunks():
+        first = part * PART_CHUNKS + 1
+        last = min(first + PART_CHUNKS, job.chunkCount + 1)
+        # a few chunks per datastore call keeps each RPC small; the
+        # response still buffers the whole part
+        for start in range(first, last, READ_BATCH):
+            keys = [ndb.Key(ExportChunk, n, parent=job.key)
+                    for n in range(start, min(start + READ_BATCH, last))]
+            for chunk in ndb.get_multi(keys):
+                if chunk:
+                    yield chunk.data
+    return job, chunks()
@@ -1,19 +1,46 @@
 #!/usr/bin/env python
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
+import backfill
+import export
+import metrics
+import migrations  # noqa: registers the backfill migrations
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
+    @metrics.instrument('crons/set_announcement')
     def get(self):
         """Set Announcement in Memcache."""
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
 
+class RebuildFacetCountsHandler(webapp2.RequestHandler):
+    @metrics.instrument('crons/rebuild_facets')
+    def get(self):
+        """Recount the conference facets."""
+        ConferenceApi._rebuildFacetCounts()
+        self.response.set_status(204)
+
+
+class UpdateFacetCountsHandler(webapp2.RequestHandler):
+    @metrics.instrument('tasks/update_facet_counts')
+    def post(self):
+        """Apply the facet count changes of a conference write."""
+        ConferenceApi._applyFacetDeltas(
+            json.loads(self.request.get('deltas')),
+            self.request.headers.get('X-AppEngine-TaskName'))
+        self.response.set_status(204)
+
+
 class SetFeaturedSpeaker(webapp2.RequestHandler):
+    @metrics.instrument('tasks/set_featured_speaker')
     def post(self):
         """Set Featured Speaker in Memcache."""
         ConferenceApi._cacheFeaturedSpeaker(
@@ -23,6 +50,7 @@ class SetFeaturedSpeaker(webapp2.RequestHandler):
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
+    @metrics.instrument('tasks/send_confirmation_email')
     def post(self):
         """Send email confirming Conference creation."""
         mail.send_mail(
@@ -36,8 +64,131 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    @metrics.instrument('tasks/update_organizer_name')
+    def post(self):
+        """Copy an organiser's new displayName onto their Conferences,
+        one page of Conferences per task."""
+        userId = self.request.get('userId')
+        pageToken = ConferenceApi._updateOrganizerNameBatch(
+            userId, self.request.get('pageToken') or None)
+        if pageToken:
+            taskqueue.add(params={'userId': userId, 'pageToken': pageToken},
+                          url='/tasks/update_organizer_name'
+                          )
+        self.response.set_status(204)
+
+
+class UpdateSessionNamesHandler(webapp2.RequestHandler):
+    @metrics.instrument('tasks/update_session_names')
+    def post(self):
+        """Copy a renamed Conference's or Speaker's name onto its
+        Sessions, one page of Sessions per task."""
+        params = {
+            'websafeConferenceKey': self.request.get('websafeConferenceKey'),
+            'speakerKey': self.request.get('speakerKey'),
+        }
+        pageToken = ConferenceApi._updateSessionNamesBatch(
+            params['websafeConferenceKey'] or None,
+            params['speakerKey'] or None,
+            self.request.get('pageToken') or None)
+        if pageToken:
+            params['pageToken'] = pageToken
+            taskqueue.add(params=params,
+                          url='/tasks/update_session_names'
+                          )
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    @metrics.instrument('tasks/export')
+    def post(self):
+        """Write the next chunk of an export."""
+        export.exportChunk(self.request.get('export'))
+        self.response.set_status(204)
+
+
+class ExportDownloadHandler(webapp2.RequestHandler):
+    @metrics.instrument('exports/download')
+    def get(self):
+        """Send one part of a finished export; the URL carries the
+        export's download token. The part is buffered in memory until
+        the handler returns."""
+        try:
+            part = int(self.request.get('part') or 0)
+        except ValueError:
+            part = -1
+        job, chunks = export.readPart(self.request.get('export'),
+                                      self.request.get('token'), part)
+        if not job:
+            self.abort(404)
+        self.response.headers['Content-Type'] = export.CONTENT_TYPES[
+            job.format]
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename="%s-%d-part%d.%s"' % (
+                job.kind, job.key.id(), part + 1, job.format))
+        for data in chunks:
+            self.response.write(data)
+
+
+class BackfillHandler(webapp2.RequestHandler):
+    @metrics.instrument('tasks/backfill')
+    def post(self):
+        """Run the next batch of a backfill."""
+        backfill.runBatch(self.request.get('name'))
+        self.response.set_status(204)
+
+
+class BackfillAdminHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress of every backfill as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(backfill.report()))
+
+    def post(self):
+        """Start, resume or pause the backfill called name."""
+        action = self.request.get('action')
+        name = self.request.get('name')
+        try:
+            batchSize = int(self.request.get('batchSize') or 0) or None
+            delay = self.request.get('delay')
+            delay = int(delay) if delay else None
+        except ValueError:
+            self.abort(400)
+        if name not in backfill.MIGRATIONS:
+            self.abort(404)
+        if action == 'start':
+            backfill.start(name, batchSize, delay)
+        elif action == 'resume':
+            backfill.resume(name, batchSize, delay)
+        elif action == 'pause':
+            backfill.pause(name)
+        else:
+            self.abort(400)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(backfill.report()))
+
+
+class MetricsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the slowest and most RPC-heavy endpoints as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(metrics.report(
+            windows=int(self.request.get('windows') or metrics.WINDOWS),
+            top=int(self.request.get('top') or 10))))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/rebuild_facets', RebuildFacetCountsHandler),
+    ('/tasks/update_facet_counts', UpdateFacetCountsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeaker),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/update_session_names', UpdateSessionNamesHandler),
+    ('/tasks/export', ExportHandler),
+    ('/exports/download', ExportDownloadHandler),
+    ('/tasks/backfill', BackfillHandler),
+    ('/admin/metrics', MetricsHandler),
+    ('/admin/backfill', BackfillAdminHandler),
 ], debug=True)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""metrics.py
+
+Per-request RPC and latency instrumentation for the Conference Central
+API and its task handlers.
+
+Functions decorated with instrument() count the datastore, memcache and
+taskqueue calls made while they run (through apiproxy hooks) and time the
+whole call. The totals are added to memcache counters in rolling windows
+of WINDOW_SECONDS with one offset_multi per request. Latencies go into
+fixed histogram buckets, so p50/p95 can be estimated from the counters.
+report() summarises the last WINDOWS windows.
+
+"""
+
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+WINDOW_SECONDS = 300
+WINDOWS = 12
+MEMCACHE_PREFIX = 'METRICS:'
+REPORT_BATCH = 500
+# upper bounds (ms) of the latency histogram buckets; the last is open
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+RPC_COUNTERS = ('datastore_get', 'datastore_query', 'datastore_put',
+                'datastore_delete', 'datastore_txn', 'memcache',
+                'taskqueue')
+
+DATASTORE_CALLS = {
+    'Get': 'datastore_get',
+    'RunQuery': 'datastore_query',
+    'Next': 'datastore_query',
+    'Put': 'datastore_put',
+    'Delete': 'datastore_delete',
+    'BeginTransaction': 'datastore_txn',
+    'Commit': 'datastore_txn',
+    'Rollback': 'datastore_txn',
+}
+
+_names = set()
+_state = threading.local()
+
+
+def _countRpc(service, call, request, response):
+    counts = getattr(_state, 'counts', None)
+    if counts is None:
+        return
+    if service == 'datastore_v3':
+        counter = DATASTORE_CALLS.get(call)
+        if counter:
+            counts[counter] += 1
+    elif service in ('memcache', 'taskqueue'):
+        counts[service] += 1
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('metrics', _countRpc)
+
+
+def _window(now=None):
+    return int((now or time.time()) // WINDOW_SECONDS)
+
+
+def _bucket(elapsed):
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def _key(window, name, counter):
+    return '%d:%s:%s' % (window, name, counter)
+
+
+def record(name, elapsed, counts, error=False):
+    """Add one call of name taking elapsed ms with the given RPC counts
+    to the current window."""
+    window = _window()
+    deltas = {
+        _key(window, name, 'calls'): 1,
+        _key(window, name, 'ms'): int(elapsed),
+        _key(window, name, 'bucket%d' % _bucket(elapsed)): 1,
+    }
+    if error:
+        deltas[_key(window, name, 'errors')] = 1
+    for counter, count in counts.items():
+        deltas[_key(window, name, counter)] = count
+    try:
+        memcache.offset_multi(deltas, key_prefix=MEMCACHE_PREFIX,
+                              initial_value=0)
+    except Exception:
+        logging.exception('Could not record metrics for %s', name)
+
+
+def instrument(name=None):
+    """Decorator counting RPCs and timing each call of the function under
+    name (default: the function's name). Nested instrumented calls are
+    counted as part of the outermost one."""
+    def decorator(func):
+        metricName = name or func.__name__
+        _names.add(metricName)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_state, 'counts', None) is not None:
+                return func(*args, **kwargs)
+            _state.counts = defaultdict(int)
+            start = time.time()
+            error = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                counts = _state.counts
+                _state.counts = None
+                record(metricName, (time.time() - start) * 1000,
+                       counts, error)
+        return wrapper
+    return decorator
+
+
+def _percentile(buckets, calls, fraction):
+    """Estimate a latency percentile as the upper bound of the histogram
+    bucket it falls in."""
+    target = calls * fraction
+    seen = 0
+    for index, count in enumerate(buckets):
+        seen += count
+        if count and seen >= target:
+            if index < len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[index]
+            return None
+    return None
+
+
+def report(windows=WINDOWS, top=10):
+    """Summarise the last `windows` windows for every instrumented name,
+    returning the `top` slowest (by p95) and most RPC-heavy (by RPCs per
+    call) entries. A p95 of None means above the largest bucket."""
+    current = _window()
+    counters = (['calls', 'ms', 'errors'] + list(RPC_COUNTERS) +
+                ['bucket%d' % i for i in range(len(LATENCY_BUCKETS) + 1)])
+    keys = [_key(window, name, counter)
+            for window in range(current - windows + 1, current + 1)
+            for name in _names
+            for counter in counters]
+    values = {}
+    for i in range(0, len(keys), REPORT_BATCH):
+        values.update(memcache.get_multi(keys[i:i + REPORT_BATCH],
+                                         key_prefix=MEMCACHE_PREFIX))
+
+    totals = defaultdict(lambda: defaultdict(int))
+    for key, value in values.items():
+        window, name, counter = key.split(':', 2)
+        totals[name][counter] += int(value)
+
+    summaries = []
+    for name, total in totals.items():
+        calls = total['calls']
+        if not calls:
+            continue
+        buckets = [total['bucket%d' % i]
+                   for i in range(len(LATENCY_BUCKETS) + 1)]
+        rpcs = dict((counter, round(total[counter] / float(calls), 2))
+                    for counter in RPC_COUNTERS)
+        summaries.append({
+            'name': name,
+            'calls': calls,
+            'errors': total['errors'],
+            'meanMs': round(total['ms'] / float(calls), 1),
+            'p50Ms': _percentile(buckets, calls, 0.5),
+            'p95Ms': _percentile(buckets, calls, 0.95),
+            'rpcsPerCall': round(sum(rpcs.values()), 2),
+            'rpcs': rpcs,
+        })
+
+    def latency(summary):
+        p95 = summary['p95Ms']
+        return (p95 is None, p95, summary['meanMs'])
+
+    return {
+        'windowSeconds': WINDOW_SECONDS,
+        'windows': windows,
+        'slowest': sorted(summaries, key=latency, reverse=True)[:top],
+        'rpcHeavy': sorted(summaries, key=lambda s: s['rpcsPerCall'],
+                           reverse=True)[:top],
+    }
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""migrations.py
+
+Backfills for the schema changes of the Conference Central models, run
+with backfill.py from /admin/backfill.
+
+"""
+
+from google.appengine.ext import ndb
+
+import backfill
+import cache
+import textsearch
+from conference import ConferenceApi
+from conference import VERSION_CONFERENCE
+from conference import VERSION_CONFERENCES
+from conference import VERSION_SESSIONS
+from models import Conference
+from models import Profile
+from models import Session
+
+
+def _speakerKey(websafeKey):
+    """Return the Speaker key for a websafe key, or None if it is not a
+    valid one; a bad key must not fail every retry of a batch."""
+    try:
+        key = ndb.Key(urlsafe=websafeKey)
+    except Exception:
+        return None
+    return key if key.kind() == 'Speaker' else None
+
+
+def _conferencesSaved(conferences):
+    # cached queryConferences pages and conference etags are stale now
+    cache.bumpVersions(VERSION_CONFERENCES,
+                       *[VERSION_CONFERENCE % conf.key.urlsafe()
+                         for conf in conferences])
+
+
+def _sessionsSaved(sessions):
+    cache.bumpVersions(*set(VERSION_SESSIONS % sess.key.parent().urlsafe()
+                            for sess in sessions))
+
+
+@backfill.migration('conference_month', Conference, saved=_conferencesSaved)
+def conferenceMonth(conferences):
+    """Derive Conference.month from startDate (0 without a date). Run
+    /crons/rebuild_facets afterwards, as the month facet counts change."""
+    changed = []
+    for conf in conferences:
+        month = conf.startDate.month if conf.startDate else 0
+        if conf.month != month:
+            conf.month = month
+            changed.append(conf)
+    return changed
+
+
+@backfill.migration('conference_organizer_name', Conference,
+                    saved=_conferencesSaved)
+def conferenceOrganizerName(conferences):
+    """Fill in organizerDisplayName for conferences stored before it was
+    kept, from the organisers' Profiles."""
+    missing = [conf for conf in conferences
+               if conf.organizerDisplayName is None]
+    organisers = list(set(conf.key.parent() for conf in missing))
+    profiles = dict(zip(organisers, cache.getMulti(organisers)))
+    changed = []
+    for conf in missing:
+        profile = profiles.get(conf.key.parent())
+        if profile and profile.displayName is not None:
+            conf.organizerDisplayName = profile.displayName
+            changed.append(conf)
+    return changed
+
+
+@backfill.migration('session_names', Session, saved=_sessionsSaved)
+def sessionNames(sessions):
+    """Fill in conferenceName and speakerName for sessions stored before
+    they were kept."""
+    speakerKeys = {}
+    keys = set()
+    for sess in sessions:
+        if sess.conferenceName is None:
+            keys.add(sess.key.parent())
+        if sess.speakerKey and sess.speakerName is None:
+            key = _speakerKey(sess.speakerKey)
+            if key:
+                speakerKeys[sess.speakerKey] = key
+                keys.add(key)
+    keys = list(keys)
+    entities = dict(zip(keys, cache.getMulti(keys)))
+    changed = []
+    for sess in sessions:
+        updated = False
+        conf = entities.get(sess.key.parent())
+        if sess.conferenceName is None and conf:
+            sess.conferenceName = conf.name
+            updated = True
+        speaker = entities.get(speakerKeys.get(sess.speakerKey))
+        if sess.speakerName is None and speaker:
+            sess.speakerName = speaker.speaker_name
+            updated = True
+        if updated:
+            changed.append(sess)
+    return changed
+
+
+@backfill.migration('session_search_fields', Session)
+def sessionSearchFields(sessions):
+    """Save every session again so its startMinutes and typeKey computed
+    properties are written to the indexes searchSessions uses."""
+    return sessions
+
+
+@backfill.migration('profile_registrations', Profile, put=False)
+def profileRegistrations(profiles):
+    """Move legacy Profile.conferenceKeysToAttend lists into Registration
+    entities, one transaction per Profile."""
+    changed = []
+    for prof in profiles:
+        if (prof.conferenceKeysToAttend and
+                ConferenceApi._migrateRegistrations(prof.key)):
+            cache.invalidate(prof.key)
+            changed.append(prof)
+    return changed
+
+
+def _reindex(entities):
+    """Rewrite the full-text search documents of entities."""
+    textsearch.index(entities)
+    return entities
+
+
+# search_conference, search_session and search_speaker rebuild the
+# search index of one kind
+for kind, model in textsearch.MODELS.items():
+    backfill.migration('search_%s' % kind, model,
+                       batchSize=textsearch.REINDEX_BATCH,
+                       put=False)(_reindex)
@@ -11,10 +11,26 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy registrations; moved to Registration entities on the
+    # user's next registration change or by the profile_registrations
+    # backfill
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishlist = ndb.StringProperty(repeated=True)
 
 
+class Registration(ndb.Model):
+    """Registration -- a user's registration for a conference.
+
+    Stored as a child of the attendee's Profile with the websafe
+    conference key as its id, so a user's registrations can be read with
+    a keys-only ancestor query. displayName and teeShirtSize are copied
+    from the Profile so attendee lists can be served by projection."""
+    conferenceKey = ndb.KeyProperty(kind='Conference')
+    displayName = ndb.StringProperty()
+    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -28,10 +44,13 @@ class ProfileForm(messages.Message):
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionWishlist = messages.StringField(5, repeated=True)
+    etag = messages.StringField(6)
+    notModified = messages.BooleanField(7)
 
 
 class ProfileForms(messages.Message):
     items = messages.MessageField(ProfileMiniForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class StringMessage(messages.Message):
@@ -45,6 +64,18 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class BatchResultForm(messages.Message):
+    """BatchResultForm -- outcome of one item of a batch create request"""
+    index = messages.IntegerField(1)
+    websafeKey = messages.StringField(2)
+    error = messages.StringField(3)
+
+
+class BatchResultForms(messages.Message):
+    """BatchResultForms -- per-item outcomes of a batch create request"""
+    items = messages.MessageField(BatchResultForm, 1, repeated=True)
+
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -74,15 +105,47 @@ class Conference(ndb.Model):
     name = ndb.StringProperty(required=True)
     description = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    # copied from the organiser's Profile; rewritten by
+    # /tasks/update_organizer_name when the displayName changes
+    organizerDisplayName = ndb.StringProperty(indexed=False)
     topics = ndb.StringProperty(repeated=True)
     city = ndb.StringProperty()
     startDate = ndb.DateProperty()
     month = ndb.IntegerProperty()
     endDate = ndb.DateProperty()
     maxAttendees = ndb.IntegerProperty()
+    # seats available when the conference was created; live counts are
+    # kept in the conference's SeatShard entities
     seatsAvailable = ndb.IntegerProperty()
 
 
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's seat allocation.
+
+    Shards are root entities (keyed by conference and shard index) so
+    that registrations for the same conference land in different entity
+    groups. A shard that has never been written is derived from the
+    Conference's initial seat count."""
+    capacity = ndb.IntegerProperty(default=0, indexed=False)
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class Announcement(ndb.Model):
+    """Announcement -- the conferences that are nearly sold out; a single
+    entity kept up to date by registrations and repaired by the cron"""
+    conferenceKeys = ndb.StringProperty(repeated=True, indexed=False)
+    conferenceNames = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class FacetCounts(ndb.Model):
+    """FacetCounts -- one shard of the number of conferences per city,
+    topic and month; the counts are the sum of all shards"""
+    # facet name -> {value: number of conferences}
+    counts = ndb.JsonProperty()
+    # names of the latest tasks applied to this shard
+    appliedTasks = ndb.StringProperty(repeated=True, indexed=False)
+
+
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
     name = messages.StringField(1)
@@ -97,11 +160,31 @@ class ConferenceForm(messages.Message):
     endDate = messages.StringField(10)
     websafeKey = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag = messages.StringField(13)
+    notModified = messages.BooleanField(14)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- number of conferences with one facet value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class FacetForm(messages.Message):
+    """FacetForm -- conference counts for each value of one filter field"""
+    field = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+
+class FacetForms(messages.Message):
+    """FacetForms -- conference counts for every facet"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -115,6 +198,10 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm
     inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    limit = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    # return summary ConferenceForms (see SUMMARY_FIELDS in conference.py)
+    summary = messages.BooleanField(4)
 
 
 class Session(ndb.Model):
@@ -126,6 +213,31 @@ class Session(ndb.Model):
     typeOfSession = ndb.StringProperty(required=True)
     startDate = ndb.DateProperty()
     startTime = ndb.TimeProperty()
+    # copied from the Speaker and Conference; rewritten by
+    # /tasks/update_session_names when either is renamed
+    speakerName = ndb.StringProperty(indexed=False)
+    conferenceName = ndb.StringProperty(indexed=False)
+    # precomputed search fields: minutes since midnight and the
+    # normalized session type
+    startMinutes = ndb.ComputedProperty(
+        lambda self: (self.startTime.hour * 60 + self.startTime.minute
+                      if self.startTime else None))
+    typeKey = ndb.ComputedProperty(
+        lambda self: (self.typeOfSession or '').strip().lower())
+
+
+class SpeakerSessionCount(ndb.Model):
+    """SpeakerSessionCount -- number of sessions a speaker gives at a
+    conference; child of the Conference, keyed by the websafe speaker key"""
+    sessionCount = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- the speaker with the most sessions at a
+    conference; a single child of the Conference"""
+    speakerKey = ndb.StringProperty(indexed=False)
+    speakerName = ndb.StringProperty(indexed=False)
+    sessionCount = ndb.IntegerProperty(default=0, indexed=False)
 
 
 class SessionForm(messages.Message):
@@ -145,6 +257,9 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
 
 
 class SessionFormByConference(messages.Message):
@@ -167,3 +282,83 @@ class SpeakerForm(messages.Message):
 
 class SpeakerForms(messages.Message):
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
+
+
+class ExportJob(ndb.Model):
+    """ExportJob -- a background export of a conference's attendees or
+    sessions; the file is stored as ExportChunk children"""
+    conferenceKey = ndb.KeyProperty(kind='Conference')
+    organizerUserId = ndb.StringProperty()
+    kind = ndb.StringProperty(choices=('attendees', 'sessions'))
+    format = ndb.StringProperty(choices=('csv', 'jsonl'))
+    status = ndb.StringProperty(default='RUNNING')
+    rowCount = ndb.IntegerProperty(default=0, indexed=False)
+    chunkCount = ndb.IntegerProperty(default=0, indexed=False)
+    # where the next chunk starts; None before the first one
+    cursor = ndb.StringProperty(indexed=False)
+    # secret required by the download URLs
+    downloadToken = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    finished = ndb.DateTimeProperty(indexed=False)
+
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- consecutive rows of an export file; child of the
+    ExportJob, keyed by its position from 1"""
+    data = ndb.BlobProperty(compressed=True)
+
+
+class ExportForm(messages.Message):
+    """ExportForm -- status of an export job"""
+    websafeKey = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    kind = messages.StringField(3)
+    format = messages.StringField(4)
+    status = messages.StringField(5)
+    rowCount = messages.IntegerField(6)
+    downloadUrls = messages.StringField(7, repeated=True)
+
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- inverted index entry for one Conference, Session
+    or Speaker, keyed by the entity's websafe key; used by textsearch.py
+    when the Search API backend is not selected"""
+    kind = ndb.StringProperty()
+    terms = ndb.StringProperty(repeated=True)
+    # term -> field-weighted occurrence count, for ranking
+    weights = ndb.JsonProperty()
+    title = ndb.StringProperty(indexed=False)
+    websafeConferenceKey = ndb.StringProperty(indexed=False)
+
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- one ranked full-text search hit"""
+    kind = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+    title = messages.StringField(3)
+    websafeConferenceKey = messages.StringField(4)
+    score = messages.FloatField(5)
+
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- one page of full-text search hits"""
+    items = messages.MessageField(SearchResultForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class BackfillRun(ndb.Model):
+    """BackfillRun -- progress of a backfill.py migration, keyed by the
+    migration name"""
+    kind = ndb.StringProperty()
+    status = ndb.StringProperty(choices=('RUNNING', 'PAUSED', 'DONE'))
+    # where the next batch starts; None before the first one
+    cursor = ndb.StringProperty(indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    updated = ndb.IntegerProperty(default=0, indexed=False)
+    batches = ndb.IntegerProperty(default=0, indexed=False)
+    batchSize = ndb.IntegerProperty(indexed=False)
+    # seconds between batches
+    delay = ndb.IntegerProperty(default=0, indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+    finished = ndb.DateTimeProperty(indexed=False)
+    lastError = ndb.TextProperty()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""queryplanner.py
+
+Query planner for queryConferences filters.
+
+The datastore serves at most one inequality property per query, and
+every combination of filters ordered by name needs a composite index. The
+planner pushes the most selective index-backed part of a filter set to
+the datastore: up to MAX_EQUALITY_FIELDS equality filters and the
+inequality filters on one property. Every other filter is checked in
+memory while the results stream in, batch by batch.
+
+CATALOG declares the filterable properties and how selective their
+filters are estimated to be. The composite indexes the planner can use
+are derived from it; run this module to print them for index.yaml:
+
+    python queryplanner.py
+
+"""
+
+import itertools
+import operator
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+
+# property -> estimated fraction of conferences matching one equality
+# filter, and the value range used to estimate inequality filters
+# (None when unbounded)
+CATALOG = {
+    'city': {'equality': 0.05, 'range': None},
+    'topics': {'equality': 0.1, 'range': None},
+    'month': {'equality': 1 / 12.0, 'range': (1, 12)},
+    'maxAttendees': {'equality': 0.02, 'range': None},
+}
+INTEGER_FIELDS = ('month', 'maxAttendees')
+ORDER = 'name'
+MAX_EQUALITY_FIELDS = 2
+# estimated fraction kept by a bound on an unbounded property, and by !=
+UNBOUNDED_RANGE = 0.5
+NOT_EQUAL = 0.9
+# entities read from the datastore for one page at most; a page can
+# come back short (with a nextPageToken) when most of them are filtered
+MAX_SCAN = 1000
+BATCH_SIZE = 100
+
+COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def indexes():
+    """Return the property lists of every composite index the planner
+    may need: equality properties, then one inequality property (if
+    any), then the sort order. Each index is listed once, in the order
+    first generated: equality and inequality filters on the last
+    property before the sort order need the same index."""
+    fields = sorted(CATALOG)
+    result = []
+    seen = set()
+    for size in range(MAX_EQUALITY_FIELDS + 1):
+        for equalities in itertools.combinations(fields, size):
+            for inequality in [None] + fields:
+                if inequality in equalities:
+                    continue
+                properties = list(equalities)
+                if inequality:
+                    properties.append(inequality)
+                if properties and tuple(properties) not in seen:
+                    seen.add(tuple(properties))
+                    result.append(properties + [ORDER])
+    return result
+
+
+def _rangeSelectivity(field, filters):
+    """Estimate the fraction of conferences kept by the inequality
+    filters on one property."""
+    if any(f['operator'] == '!=' for f in filters):
+        selectivity = NOT_EQUAL
+        filters = [f for f in filters if f['operator'] != '!=']
+    else:
+        selectivity = 1.0
+    if not filters:
+        return selectivity
+    bounds = CATALOG[field]['range']
+    if not bounds:
+        return selectivity * UNBOUNDED_RANGE ** min(len(filters), 2)
+    low, high = bounds
+    for f in filters:
+        value = f['value']
+        if f['operator'] == '>':
+            low = max(low, value + 1)
+        elif f['operator'] == '>=':
+            low = max(low, value)
+        elif f['operator'] == '<':
+            high = min(high, value - 1)
+        elif f['operator'] == '<=':
+            high = min(high, value)
+    width = float(bounds[1] - bounds[0] + 1)
+    return selectivity * max(high - low + 1, 0) / width
+
+
+def _predicate(f):
+    compare = COMPARISONS[f['operator']]
+    field, value = f['field'], f['value']
+
+    def matches(entity):
+        values = getattr(entity, field)
+        if not isinstance(values, list):
+            values = [values]
+        # as in the datastore, a repeated property matches if any of
+        # its values does, and a missing value never matches
+        return any(v is not None and compare(v, value) for v in values)
+    return matches
+
+
+def plan(filters):
+    """Plan formatted filters (dicts of field, operator and value, with
+    integer values already converted). Returns (query, predicates): the
+    datastore query for the pushed filters, ordered as the results are
+    returned, and the in-memory checks for the rest."""
+    equalities = {}
+    inequalities = {}
+    for f in filters:
+        if f['operator'] == '=':
+            equalities.setdefault(f['field'], []).append(f)
+        else:
+            inequalities.setdefault(f['field'], []).append(f)
+
+    # pick the cheapest index-backed combination; != is never pushed, as
+    # it would turn the query into a multi-query
+    best = None
+    rangeFields = [None] + [field for field, fs in inequalities.items()
+                            if all(f['operator'] != '!=' for f in fs)]
+    for size in range(min(MAX_EQUALITY_FIELDS, len(equalities)) + 1):
+        for pushedEqualities in itertools.combinations(
+                sorted(equalities), size):
+            for rangeField in rangeFields:
+                if rangeField in pushedEqualities:
+                    continue
+                selectivity = 1.0
+                for field in pushedEqualities:
+                    selectivity *= CATALOG[field]['equality']
+                if rangeField:
+                    selectivity *= _rangeSelectivity(
+                        rangeField, inequalities[rangeField])
+                if best is None or selectivity < best[0]:
+                    best = (selectivity, pushedEqualities, rangeField)
+    selectivity, pushedEqualities, rangeField = best
+
+    q = Conference.query()
+    pushed = []
+    for field in pushedEqualities:
+        # one filter per property; the index lists each property once
+        pushed.append(equalities[field][0])
+    if rangeField:
+        pushed.extend(inequalities[rangeField])
+        q = q.order(ndb.GenericProperty(rangeField))
+    q = q.order(Conference.name)
+    for f in pushed:
+        q = q.filter(ndb.query.FilterNode(f['field'], f['operator'],
+                                          f['value']))
+    predicates = [_predicate(f) for f in filters
+                  if not any(f is p for p in pushed)]
+    return q, predicates
+
+
+@ndb.tasklet
+def fetchPageAsync(query, predicates, limit, pageToken=None,
+                   projection=None):
+    """Tasklet returning up to limit entities of query that pass every
+    predicate, and the websafe cursor for the next page (or None). At
+    most MAX_SCAN entities are read per page. A projection is only
+    applied when there are no predicates to check."""
+    cursor = Cursor(urlsafe=pageToken) if pageToken else None
+    if not predicates:
+        results, next_cursor, more = yield query.fetch_page_async(
+            limit, start_cursor=cursor, projection=projection)
+        raise ndb.Return(
+            (results, next_cursor.urlsafe() if more and next_cursor
+             else None))
+
+    results = []
+    scanned = 0
+    it = query.iter(start_cursor=cursor, produce_cursors=True,
+                    batch_size=BATCH_SIZE)
+    while len(results) < limit and scanned < MAX_SCAN:
+        more = yield it.has_next_async()
+        if not more:
+            break
+        entity = it.next()
+        scanned += 1
+        if all(matches(entity) for matches in predicates):
+            results.append(entity)
+    nextPageToken = None
+    if scanned:
+        more = yield it.has_next_async()
+        if more:
+            nextPageToken = it.cursor_after().urlsafe()
+    raise ndb.Return((results, nextPageToken))
+
+
+def main():
+    print '# Conference filter indexes, generated by queryplanner.py'
+    for properties in indexes():
+        print
+        print '- kind: Conference'
+        print '  properties:'
+        for name in properties:
+            print '  - name: %s' % name
+
+
+if __name__ == '__main__':
+    main()
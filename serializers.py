@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Precompiled copying of ndb entities onto ProtoRPC messages.
+
+The copy plan for each (model, message) pair is worked out once, on first
+use, from the message's fields and the model's properties, and then
+reused for every entity. The rules are those of the original
+_copy*ToForm functions: fields ending in Date or Time are converted with
+str(), enum fields are looked up by name, websafeKey/websafeSessionKey
+take the entity's urlsafe key and every other field shared with the
+model is copied as is.
+
+A plan can be limited to a subset of the message fields, which is how
+summary responses are built from projection query results: only the
+projected properties are read.
+
+"""
+
+import operator
+
+from protorpc import messages
+
+KEY_FIELDS = ('websafeKey', 'websafeSessionKey')
+
+_plans = {}
+
+
+def _stringGetter(name):
+    get = operator.attrgetter(name)
+    return lambda entity: str(get(entity))
+
+
+def _enumGetter(name, enum):
+    get = operator.attrgetter(name)
+    return lambda entity: getattr(enum, get(entity))
+
+
+def _urlsafeKey(entity):
+    return entity.key.urlsafe()
+
+
+def _buildPlan(modelClass, messageClass, fields=None):
+    """Return the (field name, getter) pairs that copy modelClass
+    entities onto messageClass messages, limited to fields if given."""
+    plan = []
+    properties = modelClass._properties
+    for field in messageClass.all_fields():
+        name = field.name
+        if fields is not None and name not in fields:
+            continue
+        if name in properties:
+            if name.endswith('Date') or name.endswith('Time'):
+                plan.append((name, _stringGetter(name)))
+            elif isinstance(field, messages.EnumField):
+                plan.append((name, _enumGetter(name, field.type)))
+            else:
+                plan.append((name, operator.attrgetter(name)))
+        elif name in KEY_FIELDS:
+            plan.append((name, _urlsafeKey))
+    required = any(field.required for field in messageClass.all_fields())
+    return tuple(plan), required
+
+
+def getPlan(modelClass, messageClass, fields=None):
+    """Return the cached copy plan for a (model, message) pair and an
+    optional tuple of field names."""
+    plan = _plans.get((modelClass, messageClass, fields))
+    if plan is None:
+        plan = _plans[(modelClass, messageClass, fields)] = _buildPlan(
+            modelClass, messageClass, fields)
+    return plan
+
+
+def toMessage(entity, messageClass, fields=None):
+    """Copy entity (or only the named fields) onto a new messageClass
+    message."""
+    plan, required = getPlan(type(entity), messageClass, fields)
+    message = messageClass()
+    for name, get in plan:
+        setattr(message, name, get(entity))
+    # only messages with required fields can fail validation
+    if required:
+        message.check_initialized()
+    return message
+
+
+def toMessages(entities, messageClass, fields=None):
+    """Copy a list of entities of one kind (or only the named fields)
+    onto messageClass messages."""
+    if not entities:
+        return []
+    plan, required = getPlan(type(entities[0]), messageClass, fields)
+    result = []
+    for entity in entities:
+        message = messageClass()
+        for name, get in plan:
+            setattr(message, name, get(entity))
+        if required:
+            message.check_initialized()
+        result.append(message)
+    return result
@@ -14,3 +14,6 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '224347413695-k9v3nthe9dlr3shfg5dd2i0i3rabtmfh.apps.googleusercontent.com'
 
+# Full-text search backend: 'search_api' for the App Engine Search API,
+# 'datastore' for the SearchDocument inverted index
+SEARCH_BACKEND = 'search_api'
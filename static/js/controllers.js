@@ -430,11 +430,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Page size requested from the conference.queryConferences API (its maximum).
+     */
+    var QUERY_PAGE_SIZE = 100;
+
+    /**
+     * Invokes the conference.queryConferences API, following nextPageToken until every
+     * matching conference has been loaded; the list is then paginated client side.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
-            filters: []
+            filters: [],
+            limit: QUERY_PAGE_SIZE
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -446,32 +453,47 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
-        $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query conferences : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
-
-                        $scope.conferences = [];
+        var conferences = [];
+        var fetchPage = function (pageToken) {
+            var request = angular.extend({}, sendFilters);
+            if (pageToken) {
+                request.pageToken = pageToken;
+            }
+            gapi.client.conference.queryConferences(request).
+                execute(function (resp) {
+                    if (!resp.error) {
                         angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
+                            conferences.push(conference);
                         });
+                        if (resp.nextPageToken) {
+                            // more results; keep loading before updating the view
+                            fetchPage(resp.nextPageToken);
+                            return;
+                        }
                     }
-                    $scope.submitted = true;
+                    $scope.$apply(function () {
+                        $scope.loading = false;
+                        if (resp.error) {
+                            // The request has failed.
+                            var errorMessage = resp.error.message || '';
+                            $scope.messages = 'Failed to query conferences : ' + errorMessage;
+                            $scope.alertStatus = 'warning';
+                            $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+                        } else {
+                            // The request has succeeded.
+                            $scope.submitted = false;
+                            $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                            $scope.alertStatus = 'success';
+                            $log.info($scope.messages);
+
+                            $scope.conferences = conferences;
+                        }
+                        $scope.submitted = true;
+                    });
                 });
-            });
+        };
+        $scope.loading = true;
+        fetchPage(null);
     }
 
     /**
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""tests/test_cache.py
+
+Tests for the two-tier entity cache on the testbed stubs.
+
+Run from the project root with the App Engine SDK and its bundled
+libraries on the PYTHONPATH:
+
+    python -m unittest discover -s tests -p 'test_*.py'
+
+"""
+
+import unittest
+
+# testbase puts the project root on sys.path
+from testbase import TestCase
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import cache
+from models import Speaker
+
+
+class CacheTest(TestCase):
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.speaker = Speaker(key=ndb.Key(Speaker, 1),
+                               speaker_name=u'Ada Lovelace',
+                               speaker_bio=u'Analyst')
+        self.speaker.put()
+        self.memcacheKey = cache.MEMCACHE_PREFIX + self.speaker.key.urlsafe()
+
+    def testReadsThroughBothTiers(self):
+        # miss: read from the datastore, filling memcache and local
+        self.record()
+        speaker = cache.get(self.speaker.key)
+        self.assertEqual(speaker, self.speaker)
+        self.assertEqual(len(self.rpcs.calls('datastore_v3', 'Get')), 1)
+        self.assertTrue(isinstance(memcache.get(self.memcacheKey), str))
+
+        # local hit: no RPC at all
+        self.record()
+        speaker = cache.get(self.speaker.key)
+        self.assertEqual(speaker, self.speaker)
+        self.assertEqual(self.rpcs.events, [])
+
+        # another instance: memcache hit, no datastore read
+        cache._local.clear()
+        self.record()
+        speakers = cache.getMulti([self.speaker.key, ndb.Key(Speaker, 2)])
+        self.assertEqual(speakers[0], self.speaker)
+        self.assertIsNone(speakers[1])
+        self.assertEqual(self.rpcs.calls('datastore_v3', 'Get'),
+                         [[ndb.Key(Speaker, 2)]])
+
+    def testCopiesAreIndependent(self):
+        speaker = cache.get(self.speaker.key)
+        speaker.speaker_name = u'Changed'
+        self.assertEqual(cache.get(self.speaker.key).speaker_name,
+                         u'Ada Lovelace')
+
+    def testInvalidateLocksMemcache(self):
+        cache.get(self.speaker.key)
+        self.speaker.speaker_name = u'Grace Hopper'
+        self.speaker.put()
+        cache.invalidate(self.speaker.key)
+        self.assertEqual(memcache.get(self.memcacheKey), cache.LOCKED)
+
+        # a read while locked sees the write but leaves the lock alone
+        self.assertEqual(cache.get(self.speaker.key).speaker_name,
+                         u'Grace Hopper')
+        self.assertEqual(memcache.get(self.memcacheKey), cache.LOCKED)
+
+        # other instances read past the lock too until it expires
+        cache._local.clear()
+        self.assertEqual(cache.get(self.speaker.key).speaker_name,
+                         u'Grace Hopper')
+        self.assertEqual(memcache.get(self.memcacheKey), cache.LOCKED)
+
+
+if __name__ == '__main__':
+    unittest.main()
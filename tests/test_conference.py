@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""tests/test_conference.py
+
+RPC-level tests for ConferenceApi endpoints on the testbed stubs.
+
+Run from the project root with the App Engine SDK and its bundled
+libraries (endpoints, protorpc) on the PYTHONPATH:
+
+    python -m unittest discover -s tests -p 'test_*.py'
+
+"""
+
+import datetime
+import unittest
+
+# testbase puts the project root on sys.path
+from testbase import TestCase
+from testbase import login
+
+import endpoints
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+import cache
+from conference import CONF_ATTENDEES_GET_REQUEST
+from conference import ANNOUNCEMENT_ID
+from conference import CONF_CONDITIONAL_GET_REQUEST
+from conference import CONF_GET_REQUEST
+from conference import NUM_SEAT_SHARDS
+from conference import ConferenceApi
+from models import Announcement
+from models import Conference
+from models import Profile
+
+ORGANIZER = 'organizer@example.com'
+
+
+class GetConferenceTest(TestCase):
+
+    def setUp(self):
+        super(GetConferenceTest, self).setUp()
+        p_key = ndb.Key(Profile, ORGANIZER)
+        self.confKey = ndb.Key(Conference, 1, parent=p_key)
+        ndb.put_multi([
+            Profile(key=p_key, displayName='Organizer',
+                    mainEmail=ORGANIZER),
+            Conference(key=self.confKey, name='PyCon', city='London',
+                       organizerUserId=ORGANIZER,
+                       organizerDisplayName='Organizer',
+                       startDate=datetime.date(2016, 5, 1), month=5,
+                       maxAttendees=100, seatsAvailable=100),
+        ])
+
+    def testConferenceAndSeatsReadInOneRound(self):
+        wsck = self.confKey.urlsafe()
+        # a warm instance: the conference is in memcache but not in the
+        # local tier, and the seat shards come from the datastore
+        cache.get(self.confKey)
+        cache._local.clear()
+        ndb.get_context().set_memcache_policy(
+            lambda key: key.kind() != 'SeatShard')
+
+        self.record()
+        form = ConferenceApi().getConference(
+            CONF_CONDITIONAL_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck))
+
+        self.assertEqual(form.name, 'PyCon')
+        self.assertEqual(form.seatsAvailable, 100)
+        # ndb splits a get over at most 10 entity groups per RPC, and
+        # every shard is its own group, so the shards take several Gets
+        gets = self.rpcs.calls('datastore_v3', 'Get')
+        shardKeys = [key for keys in gets for key in keys]
+        self.assertEqual(sorted(shardKeys),
+                         sorted(ConferenceApi._seatShardKeys(self.confKey)))
+        # ... but they and the conference lookup are all in flight
+        # together, in one round with no per-shard round trips
+        rounds = [
+            n for n, calls in enumerate(self.rpcs.rounds())
+            for service, call, keys in calls
+            if ((service, call) == ('memcache', 'Get') and
+                cache.MEMCACHE_PREFIX + wsck in keys) or
+            (service, call) == ('datastore_v3', 'Get')]
+        self.assertEqual(len(rounds), len(gets) + 1)
+        self.assertEqual(len(set(rounds)), 1)
+
+    def testAttendeesNotQueriedForOtherUsers(self):
+        login('someone@example.com')
+        self.record()
+        with self.assertRaises(endpoints.ForbiddenException):
+            ConferenceApi().getConferenceAttendees(
+                CONF_ATTENDEES_GET_REQUEST.combined_message_class(
+                    websafeConferenceKey=self.confKey.urlsafe()))
+        self.assertEqual(self.rpcs.calls('datastore_v3', 'RunQuery'), [])
+
+
+class AnnouncementTest(TestCase):
+
+    def setUp(self):
+        super(AnnouncementTest, self).setUp()
+        p_key = ndb.Key(Profile, ORGANIZER)
+        # two seats in every shard
+        self.conf = Conference(key=ndb.Key(Conference, 1, parent=p_key),
+                               name='PyCon', organizerUserId=ORGANIZER,
+                               maxAttendees=2 * NUM_SEAT_SHARDS,
+                               seatsAvailable=2 * NUM_SEAT_SHARDS)
+        self.conf.put()
+        # testConcurrentRegistrations replaces _updateSeatShard
+        self.addCleanup(setattr, ConferenceApi, '_updateSeatShard',
+                        ConferenceApi.__dict__['_updateSeatShard'])
+
+    def testConcurrentRegistrations(self):
+        updateSeatShard = ConferenceApi.__dict__['_updateSeatShard']
+        others = [Profile(key=ndb.Key(Profile, 'user%d@example.com' % n),
+                          displayName='User %d' % n)
+                  for n in range(2 * NUM_SEAT_SHARDS - 4)]
+        ndb.put_multi(others)
+
+        def racingUpdateSeatShard(api, prof, conf, index, reg):
+            # the others fill all but two shards after this request read
+            # the shards and before it commits, without announcing
+            while others:
+                other = others.pop()
+                updateSeatShard(api, other, conf, len(others) // 2, True)
+            return updateSeatShard(api, prof, conf, index, reg)
+        ConferenceApi._updateSeatShard = racingUpdateSeatShard
+
+        login('attendee@example.com')
+        ConferenceApi().registerForConference(
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.conf.key.urlsafe()))
+
+        # 3 seats are left, though the request read 40 of them
+        self.assertEqual(
+            ConferenceApi._getSeatsAvailable([self.conf])[self.conf.key], 3)
+        announcement = ndb.Key(Announcement, ANNOUNCEMENT_ID).get()
+        self.assertEqual(announcement.conferenceKeys,
+                         [self.conf.key.urlsafe()])
+
+
+class FacetCountsTest(TestCase):
+
+    def setUp(self):
+        super(FacetCountsTest, self).setUp()
+        p_key = ndb.Key(Profile, ORGANIZER)
+        ndb.put_multi([
+            Conference(key=ndb.Key(Conference, 1, parent=p_key),
+                       name='PyCon', city='London', topics=['Web', 'Python'],
+                       organizerUserId=ORGANIZER, month=5),
+            Conference(key=ndb.Key(Conference, 2, parent=p_key),
+                       name='Unplanned', organizerUserId=ORGANIZER, month=0),
+        ])
+
+    def facets(self):
+        forms = ConferenceApi().getConferenceFacets(
+            message_types.VoidMessage())
+        return dict((form.field, dict((v.value, v.count)
+                                      for v in form.values))
+                    for form in forms.items)
+
+    def testRebuildCountsEachValue(self):
+        ConferenceApi._rebuildFacetCounts()
+        # one count per topic, and none for the missing city
+        self.assertEqual(self.facets(), {
+            'CITY': {u'London': 1},
+            'TOPIC': {u'Web': 1, u'Python': 1},
+            'MONTH': {u'5': 1, u'0': 1},
+        })
+
+    def testRetriedTaskAfterRebuildIsSkipped(self):
+        deltas = {'CITY': {u'London': 1}}
+        ConferenceApi._applyFacetDeltas(deltas, 'task-1')
+        counts = ConferenceApi._rebuildFacetCounts()
+        ConferenceApi._applyFacetDeltas(deltas, 'task-1')
+        self.assertEqual(self.facets()['CITY'], counts['CITY'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""tests/test_export.py
+
+Tests for the chunked conference exports on the testbed stubs.
+
+Run from the project root with the App Engine SDK and its bundled
+libraries on the PYTHONPATH:
+
+    python -m unittest discover -s tests -p 'test_*.py'
+
+"""
+
+import csv
+import unittest
+from StringIO import StringIO
+
+# testbase puts the project root on sys.path
+from testbase import TestCase
+
+from google.appengine.ext import ndb
+
+import export
+from models import Conference
+from models import ExportChunk
+from models import Profile
+from models import Registration
+
+ORGANIZER = 'organizer@example.com'
+ATTENDEES = 5
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.chunkRows = export.CHUNK_ROWS
+        # several chunks from a few rows
+        export.CHUNK_ROWS = 2
+        p_key = ndb.Key(Profile, ORGANIZER)
+        self.conf = Conference(key=ndb.Key(Conference, 1, parent=p_key),
+                               name='PyCon', organizerUserId=ORGANIZER)
+        entities = [self.conf]
+        for n in range(ATTENDEES):
+            email = 'attendee%d@example.com' % n
+            entities.append(Registration(
+                key=ndb.Key(Registration, self.conf.key.urlsafe(),
+                            parent=ndb.Key(Profile, email)),
+                conferenceKey=self.conf.key, displayName=email,
+                teeShirtSize='M'))
+        ndb.put_multi(entities)
+
+    def tearDown(self):
+        export.CHUNK_ROWS = self.chunkRows
+        super(ExportTest, self).tearDown()
+
+    def runExport(self, kind, format):
+        job = export.start(self.conf, kind, format)
+        for _ in range(ATTENDEES + 1):
+            export.exportChunk(job.key.urlsafe())
+            job = job.key.get()
+            if job.status == export.DONE:
+                break
+        return job
+
+    def testAttendeesExportRunsToDone(self):
+        job = self.runExport('attendees', 'csv')
+
+        self.assertEqual(job.status, export.DONE)
+        self.assertEqual(job.rowCount, ATTENDEES)
+        self.assertEqual(job.chunkCount, 3)
+        # the first task and one per chunk after the first
+        self.assertEqual(
+            len(self.taskqueue.get_filtered_tasks(url='/tasks/export')), 3)
+        chunks = ndb.get_multi([ndb.Key(ExportChunk, n, parent=job.key)
+                                for n in range(1, job.chunkCount + 1)])
+        rows = list(csv.reader(StringIO(''.join(c.data for c in chunks))))
+        self.assertEqual(rows[0], list(export.COLUMNS['attendees']))
+        self.assertEqual(
+            [row[:2] for row in rows[1:]],
+            [['attendee%d@example.com' % n, 'M'] for n in range(ATTENDEES)])
+
+        part, data = export.readPart(job.key.urlsafe(), job.downloadToken, 0)
+        self.assertEqual(part.key, job.key)
+        self.assertEqual(''.join(data), ''.join(c.data for c in chunks))
+        self.assertEqual(
+            export.readPart(job.key.urlsafe(), 'wrong', 0), (None, None))
+
+    def testRetriedChunkIsNotSavedTwice(self):
+        job = export.start(self.conf, 'attendees', 'jsonl')
+        export.exportChunk(job.key.urlsafe())
+        # a retry of the first task still carries the starting cursor
+        export._saveChunk(job.key, None, 'duplicate', 2, 'cursor')
+
+        job = job.key.get()
+        self.assertEqual(job.chunkCount, 1)
+        self.assertEqual(job.rowCount, 2)
+        self.assertIsNone(ndb.Key(ExportChunk, 2, parent=job.key).get())
+
+
+if __name__ == '__main__':
+    unittest.main()
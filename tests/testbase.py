@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""tests/testbase.py
+
+Shared setup for the tests: a fresh App Engine testbed per test with the
+datastore, memcache, task queue, urlfetch and mail stubs, and a recorder
+for the order in which a call's RPCs start and finish.
+
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import cache
+
+
+def login(email):
+    """Make endpoints.get_current_user() return a user for email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+
+class RpcTimeline(object):
+    """Records every RPC as it is made and as it completes, through
+    apiproxy pre- and post-call hooks."""
+
+    def __init__(self):
+        self.events = []
+        self.recording = False
+
+    def _record(self, phase, service, call, request):
+        if not self.recording:
+            return
+        keys = []
+        if service == 'datastore_v3' and call == 'Get':
+            keys = [ndb.Key(reference=ref) for ref in request.key_list()]
+        elif service == 'memcache' and call == 'Get':
+            keys = list(request.key_list())
+        self.events.append((phase, service, call, keys))
+
+    def pre(self, service, call, request, response):
+        self._record('pre', service, call, request)
+
+    def post(self, service, call, request, response):
+        self._record('post', service, call, request)
+
+    def install(self):
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'test_rpc_pre', self.pre)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'test_rpc_post', self.post)
+
+    def calls(self, service, call):
+        """Return the keys of each recorded service.call RPC."""
+        return [keys for phase, s, c, keys in self.events
+                if phase == 'pre' and (s, c) == (service, call)]
+
+    def rounds(self):
+        """Group the RPCs into rounds: the RPCs of a round were all in
+        flight together, before any of them completed."""
+        rounds = []
+        current = []
+        for phase, service, call, keys in self.events:
+            if phase == 'pre':
+                current.append((service, call, keys))
+            elif current:
+                rounds.append(current)
+                current = []
+        if current:
+            rounds.append(current)
+        return rounds
+
+
+class TestCase(unittest.TestCase):
+    """Runs each test on new stubs, with an empty entity cache."""
+
+    def setUp(self):
+        os.environ.setdefault('APPLICATION_ID', 'dev~test')
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # queries see every write at once
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_mail_stub()
+        self.taskqueue = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.rpcs = RpcTimeline()
+        self.rpcs.install()
+        ndb.get_context().set_cache_policy(False)
+        cache._local.clear()
+
+    def tearDown(self):
+        cache._local.clear()
+        self.testbed.deactivate()
+
+    def record(self):
+        """Start recording RPCs from now on."""
+        self.rpcs.events = []
+        self.rpcs.recording = True
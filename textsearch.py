@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""textsearch.py
+
+Full-text search over Conferences, Sessions and Speakers.
+
+Entities are indexed at write time by index(). Each becomes one document
+with a title (the entity's name, weighted highest), tags (conference
+topics) and body text (description, highlights, speaker bio). Prefixes of
+the title words are indexed too, so part of a name matches.
+
+Two backends are available, selected by settings.SEARCH_BACKEND:
+'search_api' keeps the documents in an App Engine Search API index;
+'datastore' keeps them as SearchDocument entities, an inverted index
+queried with equality filters on the terms and ranked in memory.
+
+"""
+
+import logging
+import re
+
+from google.appengine.api import search as searchapi
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import SearchDocument
+from models import Session
+from models import Speaker
+from settings import SEARCH_BACKEND
+
+INDEX_NAME = 'conference_central'
+# Search API limit for documents per put()
+PUT_BATCH = 200
+REINDEX_BATCH = 100
+MIN_PREFIX = 3
+# term limits keep SearchDocument index entries and zigzag joins small
+MAX_TERMS = 500
+MAX_QUERY_TERMS = 5
+MAX_CANDIDATES = 1000
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+BODY_WEIGHT = 1
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+MODELS = {
+    'conference': Conference,
+    'session': Session,
+    'speaker': Speaker,
+}
+
+
+def tokenize(text):
+    """Return the lower-cased words of text."""
+    return TOKEN_RE.findall((text or u'').lower())
+
+
+def _prefixes(words):
+    prefixes = set()
+    for word in words:
+        for end in range(MIN_PREFIX, len(word)):
+            prefixes.add(word[:end])
+    return prefixes
+
+
+def _document(entity):
+    """Return the searchable parts of entity as a dict with kind, title,
+    websafeConferenceKey and weighted (text, weight) pairs."""
+    if isinstance(entity, Conference):
+        return {'kind': 'conference', 'title': entity.name,
+                'websafeConferenceKey': entity.key.urlsafe(),
+                'texts': [(entity.name, TITLE_WEIGHT),
+                          (u' '.join(entity.topics), TAG_WEIGHT),
+                          (entity.description, BODY_WEIGHT)]}
+    if isinstance(entity, Session):
+        return {'kind': 'session', 'title': entity.session_name,
+                'websafeConferenceKey': entity.key.parent().urlsafe(),
+                'texts': [(entity.session_name, TITLE_WEIGHT),
+                          (entity.highlights, BODY_WEIGHT)]}
+    if isinstance(entity, Speaker):
+        return {'kind': 'speaker', 'title': entity.speaker_name,
+                'websafeConferenceKey': None,
+                'texts': [(entity.speaker_name, TITLE_WEIGHT),
+                          (entity.speaker_bio, BODY_WEIGHT)]}
+    raise TypeError('Cannot index %s entities' % entity.key.kind())
+
+
+def _searchApiDocument(entity):
+    doc = _document(entity)
+    texts = doc['texts']
+    return searchapi.Document(
+        doc_id=entity.key.urlsafe(),
+        fields=[
+            searchapi.AtomField(name='kind', value=doc['kind']),
+            searchapi.AtomField(name='conference',
+                                value=doc['websafeConferenceKey']),
+            searchapi.TextField(name='title', value=doc['title'] or u''),
+            searchapi.TextField(name='tags', value=u' '.join(
+                text or u'' for text, weight in texts
+                if weight == TAG_WEIGHT)),
+            searchapi.TextField(name='body', value=u' '.join(
+                text or u'' for text, weight in texts
+                if weight == BODY_WEIGHT)),
+            searchapi.TextField(name='prefixes', value=u' '.join(
+                _prefixes(tokenize(doc['title'])))),
+        ])
+
+
+def _searchDocument(entity):
+    doc = _document(entity)
+    weights = {}
+    for text, weight in doc['texts']:
+        for word in tokenize(text):
+            weights[word] = weights.get(word, 0) + weight
+    for prefix in _prefixes(tokenize(doc['title'])):
+        weights.setdefault(prefix, 1)
+    if len(weights) > MAX_TERMS:
+        kept = sorted(weights, key=weights.get, reverse=True)[:MAX_TERMS]
+        weights = dict((term, weights[term]) for term in kept)
+    return SearchDocument(
+        id=entity.key.urlsafe(), kind=doc['kind'], terms=sorted(weights),
+        weights=weights, title=doc['title'],
+        websafeConferenceKey=doc['websafeConferenceKey'])
+
+
+def index(entities):
+    """Add or replace the documents for entities. Search API failures are
+    logged, not raised: the entities are already saved and reindex()
+    repairs the index."""
+    entities = [entity for entity in entities if entity is not None]
+    if not entities:
+        return
+    if SEARCH_BACKEND == 'datastore':
+        ndb.put_multi([_searchDocument(entity) for entity in entities])
+        return
+    docs = [_searchApiDocument(entity) for entity in entities]
+    try:
+        for i in range(0, len(docs), PUT_BATCH):
+            searchapi.Index(name=INDEX_NAME).put(docs[i:i + PUT_BATCH])
+    except searchapi.Error:
+        logging.exception('Could not index %d documents', len(docs))
+
+
+def _searchApi(words, kind, limit, pageToken):
+    query = u' '.join(u'"%s"' % word for word in words)
+    if kind:
+        query += u' kind:%s' % kind
+    try:
+        cursor = searchapi.Cursor(web_safe_string=pageToken)
+    except ValueError:
+        raise ValueError('Invalid pageToken: %s' % pageToken)
+    options = searchapi.QueryOptions(
+        limit=limit, cursor=cursor,
+        sort_options=searchapi.SortOptions(
+            match_scorer=searchapi.MatchScorer()),
+        returned_fields=['kind', 'title', 'conference'])
+    results = searchapi.Index(name=INDEX_NAME).search(
+        searchapi.Query(query_string=query, options=options))
+    hits = []
+    for doc in results.results:
+        fields = dict((field.name, field.value) for field in doc.fields)
+        hits.append({
+            'kind': fields.get('kind'),
+            'websafeKey': doc.doc_id,
+            'title': fields.get('title'),
+            'websafeConferenceKey': fields.get('conference') or None,
+            'score': doc.sort_scores[0] if doc.sort_scores else None,
+        })
+    nextPageToken = None
+    if results.cursor and len(hits) == limit:
+        nextPageToken = results.cursor.web_safe_string
+    return hits, nextPageToken
+
+
+def _searchDatastore(words, kind, limit, pageToken):
+    try:
+        offset = int(pageToken or 0)
+    except ValueError:
+        raise ValueError('Invalid pageToken: %s' % pageToken)
+    query = SearchDocument.query()
+    for word in words[:MAX_QUERY_TERMS]:
+        query = query.filter(SearchDocument.terms == word)
+    if kind:
+        query = query.filter(SearchDocument.kind == kind)
+
+    ranked = []
+    for doc in query.fetch(MAX_CANDIDATES):
+        # terms beyond MAX_QUERY_TERMS are matched here
+        if all(word in doc.weights for word in words):
+            ranked.append(
+                (sum(doc.weights[word] for word in words), doc))
+    ranked.sort(key=lambda hit: (-hit[0], hit[1].title))
+
+    hits = [{'kind': doc.kind,
+             'websafeKey': doc.key.id(),
+             'title': doc.title,
+             'websafeConferenceKey': doc.websafeConferenceKey,
+             'score': float(score)}
+            for score, doc in ranked[offset:offset + limit]]
+    nextPageToken = None
+    if offset + limit < len(ranked):
+        nextPageToken = str(offset + limit)
+    return hits, nextPageToken
+
+
+def search(text, kind=None, limit=20, pageToken=None):
+    """Return one page of hits for the words of text, best first, as
+    (hits, nextPageToken). Every word must match. Each hit is a dict
+    with kind, websafeKey, title, websafeConferenceKey and score. Raises
+    ValueError for an unknown kind or page token."""
+    if kind and kind not in MODELS:
+        raise ValueError('Unknown kind: %s' % kind)
+    words = []
+    for word in tokenize(text):
+        if word not in words:
+            words.append(word)
+    if not words:
+        return [], None
+    if SEARCH_BACKEND == 'datastore':
+        return _searchDatastore(words, kind, limit, pageToken)
+    return _searchApi(words, kind, limit, pageToken)
@@ -1,10 +1,104 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
+from cache import LRUCache
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_PREFIX = 'TOKENINFO:'
+USERID_PREFIX = 'USERID:'
+TOKENINFO_ATTEMPTS = 3
+# total time allowed for all tokeninfo attempts of one lookup, in seconds
+TOKENINFO_DEADLINE = 5
+# tokens are cached for their remaining lifetime, at most this long
+TOKEN_MAX_TTL = 3600
+USERID_TTL = 3600
+
+# user ids resolved on this instance; entries carry their own expiry
+_resolved = LRUCache(1000, TOKEN_MAX_TTL)
+# token -> Event for lookups in progress on this instance
+_inflight = {}
+_inflightLock = threading.Lock()
+
+
+def _tokenHash(token):
+    # tokens are secrets; only their hash is used as a cache key
+    return hashlib.sha256(token).hexdigest()
+
+
+def _fetchTokenInfo(token):
+    """Ask the tokeninfo endpoint about token, returning the decoded
+    reply or {}. Failed attempts are retried at once rather than after a
+    sleep, and every attempt shares one overall deadline."""
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    stop = time.time() + TOKENINFO_DEADLINE
+    for i in range(TOKENINFO_ATTEMPTS):
+        remaining = stop - time.time()
+        if remaining <= 0:
+            break
+        rpc = urlfetch.create_rpc(deadline=remaining)
+        urlfetch.make_fetch_call(rpc, TOKENINFO_URL % (token_type, token))
+        try:
+            resp = rpc.get_result()
+        except urlfetch.Error:
+            continue
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            if token_type == 'access_token':
+                break
+            token_type = 'access_token'
+    return {}
+
+
+def _resolveToken(token):
+    """Return the user id for an OAuth token, from this instance, then
+    memcache, then the tokeninfo endpoint. Concurrent lookups of the same
+    token on this instance wait for the first one."""
+    key = _tokenHash(token)
+    resolved = _resolved.get(key)
+    if resolved and resolved[1] > time.time():
+        return resolved[0]
+
+    with _inflightLock:
+        event = _inflight.get(key)
+        owner = event is None
+        if owner:
+            event = _inflight[key] = threading.Event()
+    if not owner:
+        event.wait(TOKENINFO_DEADLINE)
+        resolved = _resolved.get(key)
+        if resolved and resolved[1] > time.time():
+            return resolved[0]
+        # the first lookup failed or timed out; try on our own
+
+    try:
+        # cached as (user id, expiry time)
+        resolved = memcache.get(key, key_prefix=TOKENINFO_PREFIX)
+        if resolved is None:
+            info = _fetchTokenInfo(token)
+            ttl = min(int(info.get('expires_in') or 0), TOKEN_MAX_TTL)
+            resolved = (info.get('user_id', ''), time.time() + ttl)
+            if resolved[0] and ttl > 0:
+                memcache.set(key, resolved, time=ttl,
+                             key_prefix=TOKENINFO_PREFIX)
+        if resolved[0] and resolved[1] > time.time():
+            _resolved.set(key, resolved)
+        return resolved[0]
+    finally:
+        if owner:
+            with _inflightLock:
+                _inflight.pop(key, None)
+            event.set()
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -14,32 +108,24 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _resolveToken(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
+        # this is just a sample that looks up an existing profile by its
+        # (indexed) email and generates an id if profile does not exist
+        # for an email; ids are kept in memcache so repeated calls agree
+        email = user.email()
+        userId = memcache.get(email, key_prefix=USERID_PREFIX)
+        if userId:
+            return userId
+        p_key = Profile.query(Profile.mainEmail == email).get(keys_only=True)
+        if p_key:
+            userId = p_key.id()
         else:
-            return str(uuid.uuid1().get_hex())
+            userId = str(uuid.uuid1().get_hex())
+        if not memcache.add(email, userId, time=USERID_TTL,
+                            key_prefix=USERID_PREFIX):
+            # another request stored an id first; use the same one
+            userId = memcache.get(email, key_prefix=USERID_PREFIX) or userId
+        return userId